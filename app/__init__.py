@@ -3,16 +3,27 @@ from flask import Flask
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import event
 from config import Config
+from app.json_provider import ORJSONProvider
 
 db = SQLAlchemy()
 migrate = Migrate()
 # Initialize scheduler as None first
 scheduler = None
 
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys when asked to, per connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
 def create_app(config_class=Config):
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     CORS(app)  # Enable CORS
     app.config.from_object(config_class)
 
@@ -21,11 +32,24 @@ def create_app(config_class=Config):
     db.init_app(app)
     migrate.init_app(app, db)
 
+    # Only on this app's own engine, and only when it is SQLite
+    with app.app_context():
+        engine = db.engine
+        if (engine.dialect.name == 'sqlite'
+                and not event.contains(engine, 'connect', _enable_sqlite_foreign_keys)):
+            event.listen(engine, 'connect', _enable_sqlite_foreign_keys)
+
     # Initialize scheduler only if it's not running
     global scheduler
     if scheduler is None or not scheduler.running:
-        scheduler = BackgroundScheduler()
-        scheduler.configure(misfire_grace_time=None)
+        scheduler = BackgroundScheduler(
+            executors={'default': ThreadPoolExecutor(app.config['SCHEDULER_MAX_WORKERS'])},
+            job_defaults={
+                'coalesce': True,
+                'max_instances': 1,
+                'misfire_grace_time': app.config['SCHEDULER_MISFIRE_GRACE_TIME']
+            }
+        )
         scheduler.start()
 
     # Register blueprints
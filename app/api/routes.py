@@ -1,41 +1,153 @@
 # app/api/routes.py
 import os
 import re
+import time
 from datetime import datetime, timedelta
-from flask import jsonify, request
+import orjson
+from flask import Response, abort, jsonify, request, stream_with_context
+from sqlalchemy.exc import IntegrityError
 from app import db
+from app.json_provider import ORJSONProvider
 from app.api import bp
+from app.cache import cached_response, cache_response, invalidate, resource_etag
 from app.models import Warehouse
 from app.models import Script
 from flask import current_app
-from app.jobs.scheduler import add_job, remove_job, execute_script
+from app.jobs.scheduler import add_job, remove_job, run_script_once
 from app.models import Job, JobExecution
 from app.jobs.scheduler import toggle_job
 from app.jobs.scheduler import update_job
 
+_CAMEL_RE = re.compile(r'([a-z0-9])([A-Z])')
+_UND_RE = re.compile(r'_+')
 
+# A log entry is a timestamped header line followed by any continuation
+# lines, up to the next header (see app/jobs/utils/logging_config.py)
+_LOG_ENTRY_RE = re.compile(
+    rb'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - ([^\n]+?) - (\w+) - (.*?)'
+    rb'(?=^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} |\Z)',
+    re.MULTILINE | re.DOTALL
+)
+_LOG_HEADER_RE = re.compile(rb'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} ', re.MULTILINE)
+_LOG_CHUNK_SIZE = 64 * 1024
+
+# Relative paths of all files under JOBS_FOLDER, refreshed every few seconds
+_JOBS_FILES_TTL = 5
+_jobs_cache = {'ts': 0, 'names': frozenset()}
+
+
+def normalize_script_name(name):
+    """Normalize script name for comparison"""
+    # First, remove 'Processor' suffix if it exists
+    name = name.replace('Processor', '')
+
+    # Remove any leading/trailing dashes or spaces
+    name = name.strip('- ')
+
+    # Handle CamelCase by inserting underscores
+    name = _CAMEL_RE.sub(r'\1_\2', name)
+
+    # Convert to lowercase and normalize spaces/underscores
+    name = name.lower().replace(' ', '_')
+
+    # Remove duplicate underscores and trim
+    name = _UND_RE.sub('_', name).strip('_')
+
+    return name
+
+
+def _jobs_files():
+    """Return the cached set of file paths in the jobs folder"""
+    now = time.monotonic()
+    if now - _jobs_cache['ts'] > _JOBS_FILES_TTL:
+        jobs_folder = current_app.config['JOBS_FOLDER']
+        _jobs_cache['names'] = frozenset(
+            os.path.relpath(os.path.join(root, name), jobs_folder)
+            for root, _, files in os.walk(jobs_folder)
+            for name in files
+        )
+        _jobs_cache['ts'] = now
+    return _jobs_cache['names']
+
+
+def iter_log_entries(log_file, threshold):
+    """
+    Yield (timestamp, script, level, message) log entries newest first
+
+    The file is read backwards in chunks and reading stops at the first entry
+    older than threshold, so only the requested time window is ever read.
+
+    Args:
+        log_file: Path to the log file
+        threshold: Oldest timestamp to include, as bytes formatted '%Y-%m-%d %H:%M:%S'
+    """
+    fd = os.open(log_file, os.O_RDONLY)
+    try:
+        end = os.lseek(fd, 0, os.SEEK_END)
+        tail = b''
+        while end > 0:
+            start = max(0, end - _LOG_CHUNK_SIZE)
+            data = os.pread(fd, end - start, start) + tail
+            end = start
+
+            # An entry is only complete once its header line has been read, so
+            # hold back everything before the first full header in this chunk.
+            # Unless we are at the start of the file, the first line may be cut.
+            if start:
+                pos = data.find(b'\n') + 1
+                header = _LOG_HEADER_RE.search(data, pos) if pos else None
+            else:
+                header = _LOG_HEADER_RE.search(data)
+            if header is None:
+                tail = data
+                continue
+            tail = data[:header.start()]
+
+            for entry in reversed(_LOG_ENTRY_RE.findall(data, header.start())):
+                # ISO-8601 timestamps sort lexicographically
+                if entry[0] < threshold:
+                    return
+                yield entry
+    finally:
+        os.close(fd)
 
 
 @bp.route('/warehouses', methods=['GET'])
 def get_warehouses():
     """Get all warehouses"""
-    warehouses = Warehouse.query.all()
-    return jsonify([{
-        'id': w.id,
-        'name': w.name,
-        'description': w.description
-    } for w in warehouses])
+    etag = resource_etag('warehouses')
+    cached = cached_response('warehouses:all', etag)
+    if cached is not None:
+        return cached
+
+    rows = db.session.query(Warehouse.id, Warehouse.name, Warehouse.description).all()
+    return cache_response('warehouses:all', jsonify([{
+        'id': id,
+        'name': name,
+        'description': description
+    } for id, name, description in rows]), etag)
 
 
 @bp.route('/warehouses/<int:id>', methods=['GET'])
 def get_warehouse(id):
     """Get a specific warehouse by ID"""
-    warehouse = Warehouse.query.get_or_404(id)
-    return jsonify({
-        'id': warehouse.id,
-        'name': warehouse.name,
-        'description': warehouse.description
-    })
+    etag = resource_etag('warehouses')
+    cached = cached_response(f'warehouses:{id}', etag)
+    if cached is not None:
+        return cached
+
+    row = db.session.query(
+        Warehouse.name, Warehouse.description
+    ).filter_by(id=id).first()
+    if row is None:
+        abort(404)
+
+    name, description = row
+    return cache_response(f'warehouses:{id}', jsonify({
+        'id': id,
+        'name': name,
+        'description': description
+    }), etag)
 
 
 @bp.route('/warehouses', methods=['POST'])
@@ -46,16 +158,19 @@ def create_warehouse():
     if 'name' not in data:
         return jsonify({'error': 'Name is required'}), 400
 
-    if Warehouse.query.filter_by(name=data['name']).first():
-        return jsonify({'error': 'Warehouse name already exists'}), 400
-
     warehouse = Warehouse(
         name=data['name'],
         description=data.get('description', '')
     )
 
+    # The unique constraint on name rejects duplicates
     db.session.add(warehouse)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Warehouse name already exists'}), 400
+    invalidate('warehouses:all')
 
     return jsonify({
         'id': warehouse.id,
@@ -71,15 +186,17 @@ def update_warehouse(id):
     data = request.get_json() or {}
 
     if 'name' in data:
-        if data['name'] != warehouse.name and \
-                Warehouse.query.filter_by(name=data['name']).first():
-            return jsonify({'error': 'Warehouse name already exists'}), 400
         warehouse.name = data['name']
 
     if 'description' in data:
         warehouse.description = data['description']
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Warehouse name already exists'}), 400
+    invalidate('warehouses:all', f'warehouses:{id}')
 
     return jsonify({
         'id': warehouse.id,
@@ -92,53 +209,77 @@ def update_warehouse(id):
 def delete_warehouse(id):
     """Delete a warehouse"""
     warehouse = Warehouse.query.get_or_404(id)
+
+    # Check if warehouse has any scripts before deletion
+    if db.session.query(Script.query.filter_by(warehouse_id=id).exists()).scalar():
+        return jsonify({
+            'error': 'Cannot delete warehouse that has associated scripts. Delete scripts first.'
+        }), 400
+
     db.session.delete(warehouse)
     db.session.commit()
+    invalidate('warehouses:all', f'warehouses:{id}', f'scripts:wh:{id}')
     return '', 204
 
 
 @bp.route('/warehouses/<int:warehouse_id>/scripts', methods=['GET'])
 def get_warehouse_scripts(warehouse_id):
     """Get all scripts for a specific warehouse"""
-    # First verify warehouse exists
-    warehouse = Warehouse.query.get_or_404(warehouse_id)
-
-    scripts = Script.query.filter_by(warehouse_id=warehouse_id).all()
-    return jsonify([{
-        'id': script.id,
-        'name': script.name,
-        'filename': script.filename,
-        'description': script.description
-    } for script in scripts])
+    etag = resource_etag('scripts')
+    cached = cached_response(f'scripts:wh:{warehouse_id}', etag)
+    if cached is not None:
+        return cached
+
+    rows = db.session.query(
+        Script.id, Script.name, Script.filename, Script.description
+    ).filter_by(warehouse_id=warehouse_id).all()
+
+    # Only an empty result needs telling apart from a missing warehouse
+    if not rows and not db.session.query(
+            Warehouse.query.filter_by(id=warehouse_id).exists()).scalar():
+        abort(404)
+    return cache_response(f'scripts:wh:{warehouse_id}', jsonify([{
+        'id': id,
+        'name': name,
+        'filename': filename,
+        'description': description
+    } for id, name, filename, description in rows]), etag)
 
 
 @bp.route('/scripts/<int:id>', methods=['GET'])
 def get_script(id):
     """Get a specific script by ID"""
-    script = Script.query.get_or_404(id)
-    return jsonify({
-        'id': script.id,
-        'name': script.name,
-        'filename': script.filename,
-        'warehouse_id': script.warehouse_id,
-        'description': script.description
-    })
+    etag = resource_etag('scripts')
+    cached = cached_response(f'scripts:{id}', etag)
+    if cached is not None:
+        return cached
+
+    row = db.session.query(
+        Script.name, Script.filename, Script.warehouse_id, Script.description
+    ).filter_by(id=id).first()
+    if row is None:
+        abort(404)
+
+    name, filename, warehouse_id, description = row
+    return cache_response(f'scripts:{id}', jsonify({
+        'id': id,
+        'name': name,
+        'filename': filename,
+        'warehouse_id': warehouse_id,
+        'description': description
+    }), etag)
 
 
 @bp.route('/warehouses/<int:warehouse_id>/scripts', methods=['POST'])
 def create_script(warehouse_id):
     """Add a new script to a warehouse"""
-    # Verify warehouse exists
-    warehouse = Warehouse.query.get_or_404(warehouse_id)
-
     data = request.get_json() or {}
 
     if not all(k in data for k in ('name', 'filename')):
         return jsonify({'error': 'Must include name and filename'}), 400
 
     # Verify the script file exists in the jobs folder
-    script_path = os.path.join(current_app.config['JOBS_FOLDER'], data['filename'])
-    if not os.path.isfile(script_path):
+    if os.path.normpath(data['filename']) not in _jobs_files():
         return jsonify({'error': 'Script file does not exist in jobs folder'}), 400
 
     script = Script(
@@ -148,8 +289,14 @@ def create_script(warehouse_id):
         warehouse_id=warehouse_id
     )
 
+    # The foreign key on warehouse_id rejects unknown warehouses
     db.session.add(script)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(404)
+    invalidate(f'scripts:wh:{warehouse_id}')
 
     return jsonify({
         'id': script.id,
@@ -174,12 +321,12 @@ def update_script(id):
 
     if 'filename' in data:
         # Verify the new script file exists
-        script_path = os.path.join(current_app.config['JOBS_FOLDER'], data['filename'])
-        if not os.path.isfile(script_path):
+        if os.path.normpath(data['filename']) not in _jobs_files():
             return jsonify({'error': 'Script file does not exist in jobs folder'}), 400
         script.filename = data['filename']
 
     db.session.commit()
+    invalidate(f'scripts:wh:{script.warehouse_id}', f'scripts:{id}')
 
     return jsonify({
         'id': script.id,
@@ -196,13 +343,14 @@ def delete_script(id):
     script = Script.query.get_or_404(id)
 
     # Check if script has any associated jobs before deletion
-    if script.jobs:
+    if db.session.query(Job.query.filter_by(script_id=id).exists()).scalar():
         return jsonify({
             'error': 'Cannot delete script that has associated jobs. Delete jobs first.'
         }), 400
 
     db.session.delete(script)
     db.session.commit()
+    invalidate(f'scripts:wh:{script.warehouse_id}', f'scripts:{id}')
 
     return '', 204
 
@@ -213,26 +361,7 @@ def get_script_logs(script_id):
     try:
         # Verify script exists
         script = Script.query.get_or_404(script_id)
-        current_app.logger.info(f"Fetching logs for script: {script.name}")
-
-        def normalize_script_name(name):
-            """Normalize script name for comparison"""
-            # First, remove 'Processor' suffix if it exists
-            name = name.replace('Processor', '')
-
-            # Remove any leading/trailing dashes or spaces
-            name = name.strip('- ')
-
-            # Handle CamelCase by inserting underscores
-            name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
-
-            # Convert to lowercase and normalize spaces/underscores
-            name = name.lower().replace(' ', '_')
-
-            # Remove duplicate underscores and trim
-            name = re.sub('_+', '_', name).strip('_')
-
-            return name
+        current_app.logger.info("Fetching logs for script: %s", script.name)
 
         # Get query parameters for filtering
         hours = request.args.get('hours', type=int, default=24)
@@ -245,107 +374,78 @@ def get_script_logs(script_id):
         log_file = os.path.join(current_app.root_path, 'logs', 'script_executions.log')
 
         if not os.path.exists(log_file):
-            current_app.logger.error(f"Log file not found at: {log_file}")
+            current_app.logger.error("Log file not found at: %s", log_file)
             return jsonify({'error': 'Log file not found'}), 404
 
         # Normalize the script name we're looking for
         script_name_normalized = normalize_script_name(script.name)
-        current_app.logger.info(f"Looking for logs matching normalized name: {script_name_normalized}")
+        current_app.logger.info("Looking for logs matching normalized name: %s", script_name_normalized)
 
-        # Read and parse log file
-        logs = []
-        current_log_entry = None
-        possible_matches = set()  # Keep track of all script names we see
-
-        with open(log_file, 'r', encoding='utf-8') as file:
-            for line_num, line in enumerate(file, 1):
-                try:
-                    line = line.strip()
-                    if not line:  # Skip empty lines
-                        continue
-
-                    # Try to identify if this is a new log entry
-                    if len(line) > 19:  # Minimum length for timestamp
-                        try:
-                            # Parse timestamp
-                            timestamp = datetime.strptime(line[:19], '%Y-%m-%d %H:%M:%S')
-
-                            # If we have a previous entry, save it
-                            if current_log_entry:
-                                logs.append(current_log_entry)
-
-                            # Parse new log entry
-                            remainder = line[20:].strip()  # Get everything after timestamp
-                            parts = remainder.split(' - ', 2)  # Split into max 3 parts
-
-                            if len(parts) >= 2:  # We need at least script_name and level
-                                log_script_name = parts[0].strip('- ')  # Remove any leading/trailing dashes
-                                level = parts[1].strip()
-                                message = parts[2].strip() if len(parts) > 2 else ""
-
-                                # Keep track of original script names for debugging
-                                possible_matches.add(log_script_name)
-
-                                # Normalize the script name from logs for comparison
-                                log_script_normalized = normalize_script_name(log_script_name)
-
-                                # Debug first few entries
-                                if line_num <= 5:
-                                    current_app.logger.debug(
-                                        f"Line {line_num}:\n"
-                                        f"  Original log name: '{log_script_name}'\n"
-                                        f"  Normalized log name: '{log_script_normalized}'\n"
-                                        f"  Looking for: '{script_name_normalized}'\n"
-                                        f"  Match? {script_name_normalized == log_script_normalized}"
-                                    )
-
-                                # Check for match
-                                if script_name_normalized == log_script_normalized:
-                                    current_log_entry = {
-                                        'timestamp': timestamp.isoformat(),
-                                        'level': level,
-                                        'message': message
-                                    }
-                                else:
-                                    current_log_entry = None
-                            else:
-                                current_log_entry = None
-                        except ValueError:
-                            # Not a timestamp line, append to current message if exists
-                            if current_log_entry:
-                                current_log_entry['message'] += '\n' + line
-                    elif current_log_entry:
-                        # Append this line to the current message
-                        current_log_entry['message'] += '\n' + line
-
-                except Exception as e:
-                    current_app.logger.error(f"Error parsing line {line_num}: {str(e)}")
-                    continue
+        # Only compare against the requested level and time window once
+        level_filter = log_level.upper() if log_level else None
+        threshold_str = time_threshold.strftime('%Y-%m-%d %H:%M:%S').encode('ascii')
 
-        # Add the last log entry if exists
-        if current_log_entry:
-            logs.append(current_log_entry)
+        script_name = script.name
 
-        # Filter logs by time threshold
-        logs = [log for log in logs if datetime.fromisoformat(log['timestamp']) >= time_threshold]
+        def matching_entries():
+            """Yield the matching entries, newest first"""
+            # Normalized names keyed by raw log name; the keys double as the
+            # set of all script names we see
+            normalized_names = {}
+            count = 0
 
-        # Filter by log level if specified
-        if log_level:
-            logs = [log for log in logs if log['level'].upper() == log_level.upper()]
+            for timestamp, log_script_name, level, message in iter_log_entries(log_file, threshold_str):
+                level = level.decode('ascii')
+                if level_filter and level.upper() != level_filter:
+                    continue
 
-        current_app.logger.info(f"Found {len(logs)} log entries for script {script.name}")
-        current_app.logger.info(f"All script names found in logs (before normalization): {sorted(possible_matches)}")
+                log_script_name = log_script_name.decode('utf-8', 'replace').strip('- ')
+                log_script_normalized = normalized_names.get(log_script_name)
+                if log_script_normalized is None:
+                    log_script_normalized = normalize_script_name(log_script_name)
+                    normalized_names[log_script_name] = log_script_normalized
 
-        if logs:
-            current_app.logger.info(f"Sample log entry: {logs[0]}")
+                if log_script_normalized != script_name_normalized:
+                    continue
 
-        # Sort logs by timestamp (newest first)
-        logs.sort(key=lambda x: x['timestamp'], reverse=True)
+                entry = {
+                    'timestamp': timestamp.decode('ascii').replace(' ', 'T'),
+                    'level': level,
+                    'message': message.decode('utf-8', 'replace').strip()
+                }
+                if not count:
+                    current_app.logger.info("Sample log entry: %s", entry)
+                yield entry
+                count += 1
+
+            current_app.logger.info("Found %d log entries for script %s", count, script_name)
+            current_app.logger.info("All script names found in logs (before normalization): %s",
+                                    sorted(normalized_names))
+
+        # The search runs up to the first match before the response is
+        # returned, so a missing or unreadable log still gets a 500 instead
+        # of a 200 with a truncated body
+        entries = matching_entries()
+        first = next(entries, None)
+
+        def generate():
+            """Stream the entries as a JSON array"""
+            yield b'['
+            if first is not None:
+                yield orjson.dumps(first, option=ORJSONProvider.option)
+                try:
+                    for entry in entries:
+                        yield b','
+                        yield orjson.dumps(entry, option=ORJSONProvider.option)
+                except Exception as e:
+                    current_app.logger.error("Error streaming logs: %s", e)
+                    raise
+            yield b']'
 
-        return jsonify(logs)
+        return Response(stream_with_context(generate()), mimetype='application/json')
 
     except Exception as e:
-        current_app.logger.error(f"Error fetching logs: {str(e)}")
+        current_app.logger.error("Error fetching logs: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
@@ -357,22 +457,32 @@ def not_found_error(error):
 
 @bp.errorhandler(500)
 def internal_error(error):
-    db.session.rollback()
+    # Only roll back when the failing request actually left a transaction open
+    session = db.session
+    if session.is_active and session.in_transaction():
+        session.rollback()
     return jsonify({'error': 'Internal server error'}), 500
 
 
 @bp.route('/jobs', methods=['GET'])
 def get_jobs():
     """List all scheduled jobs"""
-    jobs = Job.query.all()
-    return jsonify([{
-        'id': job.id,
-        'job_id': job.job_id,
-        'script_id': job.script_id,
-        'cron_expression': job.cron_expression,
-        'enabled': job.enabled,
-        'created_at': job.created_at.isoformat()
-    } for job in jobs])
+    etag = resource_etag('jobs')
+    cached = cached_response('jobs:all', etag)
+    if cached is not None:
+        return cached
+
+    rows = db.session.query(
+        Job.id, Job.job_id, Job.script_id, Job.cron_expression, Job.enabled, Job.created_at
+    ).all()
+    return cache_response('jobs:all', jsonify([{
+        'id': id,
+        'job_id': job_id,
+        'script_id': script_id,
+        'cron_expression': cron_expression,
+        'enabled': enabled,
+        'created_at': created_at
+    } for id, job_id, script_id, cron_expression, enabled, created_at in rows]), etag)
 
 
 @bp.route('/jobs', methods=['POST'])
@@ -385,13 +495,14 @@ def create_job():
 
     try:
         job = add_job(data['script_id'], data['cron_expression'])
+        invalidate('jobs:all')
         return jsonify({
             'id': job.id,
             'job_id': job.job_id,
             'script_id': job.script_id,
             'cron_expression': job.cron_expression,
             'enabled': job.enabled,
-            'created_at': job.created_at.isoformat()
+            'created_at': job.created_at
         }), 201
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
@@ -404,6 +515,7 @@ def delete_job(id):
     """Delete a scheduled job"""
     try:
         remove_job(id)
+        invalidate('jobs:all')
         return '', 204
     except ValueError as e:
         return jsonify({'error': str(e)}), 404
@@ -416,6 +528,7 @@ def toggle_job_status(id):
     """Toggle a job's enabled status (pause/resume)"""
     try:
         enabled = toggle_job(id)
+        invalidate('jobs:all')
         return jsonify({
             'message': f"Job {'resumed' if enabled else 'paused'} successfully",
             'enabled': enabled
@@ -436,6 +549,7 @@ def update_job_route(id):
             job_id=id,
             cron_expression=data.get('cron_expression')
         )
+        invalidate('jobs:all')
 
         return jsonify({
             'id': job.id,
@@ -443,7 +557,7 @@ def update_job_route(id):
             'script_id': job.script_id,
             'cron_expression': job.cron_expression,
             'enabled': job.enabled,
-            'created_at': job.created_at.isoformat()
+            'created_at': job.created_at
         })
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
@@ -455,41 +569,27 @@ def update_job_route(id):
 @bp.route('/run_now/<int:script_id>', methods=['POST'])
 def run_script_now(script_id):
     """Immediately run a script"""
-    script = Script.query.get_or_404(script_id)
+    if not db.session.query(Script.query.filter_by(id=script_id).exists()).scalar():
+        abort(404)
 
     try:
-        # Create a temporary job for immediate execution
-        temp_job = Job(
-            job_id=f'temp_{script_id}_{datetime.utcnow().timestamp()}',
-            script_id=script_id,
-            cron_expression='once'
-        )
-        db.session.add(temp_job)
-        db.session.commit()
-
-        try:
-            execute_script(temp_job.id)
-            return jsonify({'message': 'Script execution started'}), 202
-        except Exception as e:
-            raise e
-        finally:
-            # Clean up temporary job
-            db.session.delete(temp_job)
-            db.session.commit()
-
+        run_script_once(script_id)
+        return jsonify({'message': 'Script execution started'}), 202
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': f'Failed to run script: {str(e)}'}), 500
 
 
 @bp.route('/executions/<int:job_id>', methods=['GET'])
 def get_job_executions(job_id):
     """Get execution history for a job"""
-    executions = JobExecution.query.filter_by(job_id=job_id).order_by(JobExecution.start_time.desc()).all()
+    rows = db.session.query(
+        JobExecution.id, JobExecution.start_time, JobExecution.end_time,
+        JobExecution.status, JobExecution.error_message
+    ).filter_by(job_id=job_id).order_by(JobExecution.start_time.desc()).all()
     return jsonify([{
-        'id': exe.id,
-        'start_time': exe.start_time.isoformat(),
-        'end_time': exe.end_time.isoformat() if exe.end_time else None,
-        'status': exe.status,
-        'error_message': exe.error_message
-    } for exe in executions])
\ No newline at end of file
+        'id': id,
+        'start_time': start_time,
+        'end_time': end_time,
+        'status': status,
+        'error_message': error_message
+    } for id, start_time, end_time, status, error_message in rows])
\ No newline at end of file
@@ -0,0 +1,145 @@
+# app/cache.py
+import logging
+import time
+from flask import Response, current_app, request
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def get_client():
+    """Return the shared Redis client, or None if caching is not configured"""
+    global _client
+    if _client is None:
+        url = current_app.config.get('REDIS_URL')
+        if not url:
+            return None
+        import redis
+        _client = redis.Redis.from_url(url)
+    return _client
+
+
+def cache_get(key):
+    """Return the cached bytes for key, or None on a miss"""
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        return client.get(key)
+    except Exception as e:
+        logger.warning("Cache read failed for %s: %s", key, e)
+        return None
+
+
+def cache_set(key, data, ttl=None):
+    """Store bytes under key for ttl seconds (default: CACHE_TTL)"""
+    client = get_client()
+    if client is None:
+        return
+    try:
+        client.set(key, data, ex=ttl or current_app.config['CACHE_TTL'])
+    except Exception as e:
+        logger.warning("Cache write failed for %s: %s", key, e)
+
+
+def invalidate(*keys):
+    """
+    Drop cached entries after a write
+
+    Keys are named '<family>:...'; the version of every family touched is
+    bumped as well, which changes the ETag of that family's responses and
+    the key its bodies are cached under.
+    """
+    client = get_client()
+    if client is None:
+        return
+    families = sorted({key.split(':', 1)[0] for key in keys})
+    try:
+        # Drop the bodies cached for the current versions; older ones are
+        # already unreachable and expire with CACHE_TTL
+        versions = dict(zip(families, client.mget([f'{family}:ver' for family in families])))
+        stale = []
+        for key in keys:
+            version = versions[key.split(':', 1)[0]]
+            if version is not None:
+                stale.append(_body_key(key, _etag(key.split(':', 1)[0], version)))
+        pipe = client.pipeline()
+        if stale:
+            pipe.delete(*stale)
+        for family in families:
+            _seed_version(pipe, family)
+            pipe.incr(f'{family}:ver')
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Cache invalidation failed for %s: %s", keys, e)
+
+
+def _seed_version(pipe, family):
+    """
+    Queue setting the version of a family that has none yet
+
+    Versions start from the current time rather than 0, so a version lost
+    with a Redis restart or eviction never repeats an ETag (or cache key)
+    handed out before.
+    """
+    pipe.set(f'{family}:ver', time.time_ns(), nx=True)
+
+
+def resource_etag(family):
+    """Return a weak ETag value for the current version of a resource family"""
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline()
+        _seed_version(pipe, family)
+        pipe.get(f'{family}:ver')
+        version = pipe.execute()[-1]
+    except Exception as e:
+        logger.warning("Cache version read failed for %s: %s", family, e)
+        return None
+    return _etag(family, version)
+
+
+def _etag(family, version):
+    """ETag value of a family at a version"""
+    return f'{family}-{int(version)}'
+
+
+def _body_key(key, etag):
+    """
+    Key a response body is cached under
+
+    The body is tied to the version it was built from: once the version
+    moves on, a body cached by a request that raced with the write is
+    never served again.
+    """
+    return f'{key}@{etag}' if etag else key
+
+
+def cached_response(key, etag=None):
+    """
+    Return a response that can be sent without querying the database
+
+    That is a 304 if the client already holds etag, or the prebuilt JSON
+    body if key is cached. Returns None if the response must be built.
+    """
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        data = cache_get(_body_key(key, etag))
+        if data is None:
+            return None
+        response = Response(data, mimetype='application/json')
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def cache_response(key, response, etag=None):
+    """Cache the serialized body of a JSON response and return it"""
+    cache_set(_body_key(key, etag), response.get_data())
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
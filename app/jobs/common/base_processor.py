@@ -1,14 +1,38 @@
 # app/jobs/common/base_processor.py
-import logging
-from typing import Dict, Any, List
-from pathlib import Path
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple
 from abc import ABC, abstractmethod
-from datetime import datetime
+from app.jobs.common.database_manager import execute_values
+from app.jobs.utils.logging_config import setup_script_logging
 
 
 class BaseProcessor(ABC):
     """Base class for all data processors"""
 
+    # Statement (with a {values} placeholder) and per-row template used to
+    # flush rows queued with _buffer_write; set by child classes that buffer
+    PENDING_WRITE_SQL: Optional[str] = None
+    PENDING_WRITE_TEMPLATE: Optional[str] = None
+    # Raw record field identifying a record; when set, only the first record
+    # for each value is processed (the raw queries join unit tables that can
+    # repeat a record)
+    DEDUP_KEY: Optional[str] = None
+    # Number of batches processed concurrently, each in its own transaction
+    # on its own pooled connection. Only processors whose batches are
+    # independent of each other (no rows created by one batch being read by
+    # another) and that update their counters with _add_counts may raise it
+    MAX_WORKERS = 1
+    # svenn_products tables the processor writes in bulk; when set, batches
+    # run without foreign key checks and the tables are analyzed after a run
+    BULK_IMPORT_TABLES: Tuple[str, ...] = ()
+    # Number of batches fetched ahead while the current batch is written
+    PREFETCH_BATCHES = 4
+
     def __init__(self, db_manager, batch_size: int = 100):
         """
         Initialize the base processor
@@ -22,102 +46,314 @@ class BaseProcessor(ABC):
         self.processed_count = 0
         self.error_count = 0
         self.start_time = None
+        self._local = threading.local()
+        self._count_lock = threading.Lock()
 
         # Setup logging
-        self.logger = self._setup_logging()
+        self.logger = setup_script_logging(self.__class__.__name__)
 
-    def _setup_logging(self) -> logging.Logger:
-        """Configure logging for the processor"""
-        logger = logging.getLogger(self.__class__.__name__)
-        logger.setLevel(logging.INFO)
+    @abstractmethod
+    def _fetch_raw_data(self) -> Iterable[Dict[str, Any]]:
+        """
+        Fetch raw data from source database
+        Must be implemented by child classes; returning a generator lets
+        records be processed without loading the whole result set
+        """
+        pass
 
-        # Remove any existing handlers
-        for handler in logger.handlers[:]:
-            logger.removeHandler(handler)
+    def _fetch_batches(self) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield the raw data in batches of at most batch_size records
 
-        # Create formatters and handlers
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                                      '%Y-%m-%d %H:%M:%S')  # Removed microseconds from format
+        By default _fetch_raw_data is cut into batches; child classes whose
+        source has a unique ordered key can override this to page through
+        it with DatabaseManager.fetch_keyset_pages instead
+        """
+        records = iter(self._fetch_raw_data())
+        if self.DEDUP_KEY:
+            records = self._unique_records(records, self.DEDUP_KEY)
+        while batch := list(islice(records, self.batch_size)):
+            yield batch
 
-        # Console Handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+    def _prefetched_batches(self) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield the batches of _fetch_batches, fetched on a background thread
+
+        Reading raw_data and writing svenn_products both wait on the network
+        and use separate connections, so up to PREFETCH_BATCHES batches are
+        fetched while the current one is being written. An error while
+        fetching is raised here.
+        """
+        batches = queue.Queue(maxsize=self.PREFETCH_BATCHES)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            # Give up once the consumer has stopped, so the thread (and its
+            # raw_data connection) isn't left blocked on a full queue
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce() -> None:
+            try:
+                for batch in self._fetch_batches():
+                    if not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(done)
 
-        # File Handler
+        producer = threading.Thread(
+            target=produce, name=f"{self.__class__.__name__}-fetch", daemon=True
+        )
+        producer.start()
         try:
-            log_file = Path(__file__).parent.parent.parent / 'logs' / 'script_executions.log'
-            file_handler = logging.FileHandler(str(log_file))
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
-        except Exception as e:
-            logger.error(f"Failed to set up file logging: {e}")
+            while (item := batches.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
 
-        return logger
+    @staticmethod
+    def _unique_records(records: Iterable[Dict[str, Any]], key: str) -> Iterator[Dict[str, Any]]:
+        """Yield only the first record for each value of key"""
+        seen = set()
+        for record in records:
+            value = record.get(key)
+            if value in seen:
+                continue
+            seen.add(value)
+            yield record
 
     @abstractmethod
-    def _fetch_raw_data(self) -> List[Dict[str, Any]]:
+    def process_record(self, record: Dict[str, Any], cursor) -> None:
         """
-        Fetch raw data from source database
+        Process a single record using the batch's cursor
         Must be implemented by child classes
         """
         pass
 
-    @abstractmethod
-    def process_record(self, record: Dict[str, Any]) -> None:
+    def process_records_bulk(self, batch: List[Dict[str, Any]], cursor) -> None:
         """
-        Process a single record
-        Must be implemented by child classes
+        Process a batch of records with as few database round trips as possible
+
+        Child classes can override this to write the whole batch at once
+        (e.g. a single multi-row INSERT); by default each record is passed
+        to process_record under one savepoint for the whole batch
         """
-        pass
+        def write() -> None:
+            for record in batch:
+                self.process_record(record, cursor)
 
-    def process_batch(self, batch: List[Dict[str, Any]]) -> None:
-        """Process a batch of records"""
+        self._write_bulk_with_fallback(batch, cursor, write)
+
+    def _process_records_individually(self, batch: List[Dict[str, Any]], cursor) -> None:
+        """Pass each record to process_record, skipping the ones that fail"""
         for record in batch:
+            # A savepoint per record keeps a failing record from leaving
+            # partial writes behind in the batch transaction
+            cursor.execute("SAVEPOINT batch_record")
             try:
-                self.process_record(record)
-                self.processed_count += 1
+                self.process_record(record, cursor)
+                cursor.execute("RELEASE SAVEPOINT batch_record")
+                self._commit_counts(processed=1)
             except Exception as e:
-                self.logger.error(f"Error processing record: {e}")
-                self.error_count += 1
+                cursor.execute("ROLLBACK TO SAVEPOINT batch_record")
+                self._discard_writes()
+                self.logger.error("Error processing record: %s", e)
+                self._add_counts(errors=1)
+
+    def _write_bulk_with_fallback(self, batch: List[Dict[str, Any]], cursor,
+                                  write: Callable[[], None]) -> None:
+        """
+        Run a bulk write for a batch under a savepoint
+
+        If the bulk write fails it is rolled back and the batch is retried
+        record by record through process_record, so only the bad records
+        are lost. Counters staged with _stage_count while building and
+        writing the batch are only applied once the write is kept; the
+        record by record retry stages its own.
+
+        Args:
+            batch: Raw records the bulk write was built from
+            cursor: Database cursor of the batch transaction
+            write: Callable performing the bulk write
+        """
+        cursor.execute("SAVEPOINT bulk_batch")
+        try:
+            write()
+            cursor.execute("RELEASE SAVEPOINT bulk_batch")
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT bulk_batch")
+            self._discard_writes()
+            self.logger.warning("Bulk write failed, retrying record by record: %s", e)
+            self._process_records_individually(batch, cursor)
+            return
+
+        self._commit_counts(processed=len(batch))
+
+    @property
+    def _pending(self) -> Dict[Any, tuple]:
+        """Rows queued with _buffer_write, kept per thread"""
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def _add_counts(self, processed: int = 0, errors: int = 0) -> None:
+        """Add to the processed and error counters from any worker thread"""
+        with self._count_lock:
+            self.processed_count += processed
+            self.error_count += errors
+
+    @property
+    def _staged_counts(self) -> Dict[str, int]:
+        """Counter increments of the batch being written, kept per thread"""
+        staged = getattr(self._local, 'staged_counts', None)
+        if staged is None:
+            staged = self._local.staged_counts = {}
+        return staged
+
+    def _stage_count(self, name: str, amount: int = 1) -> None:
+        """Stage an increment of the counter attribute name until _commit_counts"""
+        staged = self._staged_counts
+        staged[name] = staged.get(name, 0) + amount
+
+    def _commit_counts(self, processed: int = 0, errors: int = 0) -> None:
+        """Apply the staged counter increments along with processed and errors"""
+        staged = self._staged_counts
+        with self._count_lock:
+            self.processed_count += processed
+            self.error_count += errors
+            for name, amount in staged.items():
+                setattr(self, name, getattr(self, name) + amount)
+        staged.clear()
+
+    def _discard_writes(self) -> None:
+        """Drop the queued rows and staged counters of a rolled back write"""
+        self._pending.clear()
+        self._staged_counts.clear()
+
+    def _buffer_write(self, key: Any, row: tuple) -> None:
+        """
+        Queue a row to be written when the batch is flushed
+
+        A later row with the same key replaces the earlier one, so records
+        repeated within a batch are only written once.
+        """
+        self._pending[key] = row
+
+    def _flush_pending(self, cursor) -> int:
+        """
+        Write all queued rows with PENDING_WRITE_SQL and clear the queue
+
+        Returns:
+            int: Number of rows affected
+        """
+        if not self._pending:
+            return 0
+        try:
+            return execute_values(
+                cursor, self.PENDING_WRITE_SQL, self._pending.values(), self.PENDING_WRITE_TEMPLATE
+            )
+        finally:
+            self._pending.clear()
+
+    def process_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Process a batch of records in a single transaction"""
+        bulk_import = bool(self.BULK_IMPORT_TABLES)
+        # Nothing staged by an earlier batch that failed on this thread
+        self._discard_writes()
+        with self.db_manager.transaction('svenn_products', bulk_import=bulk_import) as cursor:
+            self.process_records_bulk(batch, cursor)
+            # A failing flush aborts (and rolls back) the whole batch
+            self._flush_pending(cursor)
 
     def process_all(self) -> None:
         """Process all records in batches"""
-        self.start_time = datetime.utcnow()
+        self.start_time = time.perf_counter()
         try:
-            self.logger.info(f"Starting {self.__class__.__name__} processing")
-            raw_data = self._fetch_raw_data()
+            self.logger.info("Starting %s processing", self.__class__.__name__)
+            if self.MAX_WORKERS > 1:
+                current_batch = self._process_batches_concurrently()
+            else:
+                current_batch = 0
+                for batch in self._prefetched_batches():
+                    current_batch += 1
+                    self.logger.info("Processing batch %d (%d records)", current_batch, len(batch))
 
-            if not raw_data:
+                    try:
+                        self.process_batch(batch)
+                    except Exception as e:
+                        self.logger.error("Error processing batch %d: %s", current_batch, e)
+                        raise
+
+            if not current_batch:
                 self.logger.warning("No data found to process")
                 return
 
-            total_batches = (len(raw_data) + self.batch_size - 1) // self.batch_size
-            self.logger.info(f"Found {len(raw_data)} records to process in {total_batches} batches")
+            self._analyze_bulk_import_tables()
+            self._log_summary()
 
-            for i in range(0, len(raw_data), self.batch_size):
-                batch = raw_data[i:i + self.batch_size]
-                current_batch = (i // self.batch_size) + 1
-                self.logger.info(f"Processing batch {current_batch}/{total_batches}")
+        except Exception as e:
+            self.logger.error("Error during batch processing: %s", e)
+            raise
 
-                try:
-                    self.process_batch(batch)
-                except Exception as e:
-                    self.logger.error(f"Error processing batch {current_batch}: {e}")
-                    raise
+    def _process_batches_concurrently(self) -> int:
+        """
+        Process batches on MAX_WORKERS threads
 
-            self._log_summary()
+        At most two batches per worker are fetched ahead of the writes, so
+        memory stays bounded while the raw data is streamed.
+
+        Returns:
+            int: Number of batches processed
+        """
+        current_batch = 0
+        in_flight = deque()
 
+        def wait_for_oldest() -> None:
+            number, future = in_flight.popleft()
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.error("Error processing batch %d: %s", number, e)
+                raise
+
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS,
+                                thread_name_prefix=self.__class__.__name__) as executor:
+            for batch in self._fetch_batches():
+                current_batch += 1
+                self.logger.info("Processing batch %d (%d records)", current_batch, len(batch))
+                in_flight.append((current_batch, executor.submit(self.process_batch, batch)))
+                if len(in_flight) >= self.MAX_WORKERS * 2:
+                    wait_for_oldest()
+
+            while in_flight:
+                wait_for_oldest()
+
+        return current_batch
+
+    def _analyze_bulk_import_tables(self) -> None:
+        """Refresh the statistics of BULK_IMPORT_TABLES; a failure is only logged"""
+        try:
+            self.db_manager.analyze_tables('svenn_products', self.BULK_IMPORT_TABLES)
         except Exception as e:
-            self.logger.error(f"Error during batch processing: {e}")
-            raise
+            self.logger.warning("Failed to analyze %s: %s", ', '.join(self.BULK_IMPORT_TABLES), e)
 
     def _log_summary(self) -> None:
         """Log processing summary"""
-        end_time = datetime.utcnow()
-        duration = (end_time - self.start_time).total_seconds()
+        duration = time.perf_counter() - self.start_time
 
         self.logger.info("\nProcessing Summary:")
-        self.logger.info(f"Total records processed: {self.processed_count}")
-        self.logger.info(f"Total errors: {self.error_count}")
-        self.logger.info(f"Processing completed in {duration:.2f} seconds")
\ No newline at end of file
+        self.logger.info("Total records processed: %d", self.processed_count)
+        self.logger.info("Total errors: %d", self.error_count)
+        self.logger.info("Processing completed in %.2f seconds", duration)
\ No newline at end of file
@@ -1,19 +1,86 @@
 import os
 import logging
+import threading
 from contextlib import contextmanager
-import pymysql
-from typing import Optional, Any
+from functools import lru_cache
+from dbutils.pooled_db import PooledDB
+from typing import Optional, Any, Dict, Iterable, Iterator, List, Sequence
 from dotenv import load_dotenv
 from pathlib import Path
-from pymysql.cursors import DictCursor
+
+# mysqlclient (C extension) is the default driver; PyMySQL is the pure-Python
+# fallback for environments where mysqlclient can't be built
+try:
+    import MySQLdb as db_driver
+    from MySQLdb.cursors import DictCursor, SSDictCursor
+except ImportError:
+    import pymysql as db_driver
+    from pymysql.cursors import DictCursor, SSDictCursor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=64)
+def _values_statement(sql: str, template: str, row_count: int) -> str:
+    """Build (once per shape) a statement with row_count VALUES templates"""
+    return sql.format(values=', '.join([template] * row_count))
+
+
+def execute_values(cursor, sql: str, rows: Iterable[Sequence[Any]], template: str,
+                   page_size: int = 1000) -> int:
+    """
+    Execute a statement with a multi-row VALUES list, one round trip per page
+
+    Args:
+        cursor: Database cursor
+        sql: Statement with a single {values} placeholder for the VALUES list
+        rows: Parameter tuples, one per row
+        template: Placeholder template for one row, e.g. '(%s, %s, NOW())'
+        page_size: Maximum number of rows per statement
+
+    Returns:
+        int: Total number of rows affected
+    """
+    rows = list(rows)
+    affected = 0
+    for start in range(0, len(rows), page_size):
+        page = rows[start:start + page_size]
+        statement = _values_statement(sql, template, len(page))
+        cursor.execute(statement, [param for row in page for param in row])
+        affected += cursor.rowcount
+    return affected
+
+
+# MySQL errors after which a transaction can simply be run again:
+# ER_LOCK_WAIT_TIMEOUT (1205) and ER_LOCK_DEADLOCK (1213)
+RETRYABLE_LOCK_ERRORS = frozenset((1205, 1213))
+
+
+def is_lock_error(error: BaseException) -> bool:
+    """Whether error is a lock wait timeout or deadlock reported by MySQL"""
+    return (isinstance(error, db_driver.Error)
+            and bool(error.args) and error.args[0] in RETRYABLE_LOCK_ERRORS)
+
+
 class DatabaseManager:
     """Manages database connections and operations for multiple databases"""
 
+    # Connection pool sizing, per database. raw_data only serves reads,
+    # mostly long streaming queries, and is capped so a burst of them can't
+    # exhaust the server; svenn_products takes the batch writes
+    POOL_SIZES = {
+        'raw_data': {'mincached': 2, 'maxcached': 4, 'maxconnections': 4},
+        'svenn_products': {'mincached': 2, 'maxcached': 8, 'maxconnections': 8},
+    }
+    # Configuration values that must be set for every database
+    REQUIRED_CONFIG_FIELDS = ('host', 'user', 'database', 'port')
+    # Ping connections when they are taken from the pool, so one the server
+    # dropped (e.g. after wait_timeout) is reopened before it is used
+    POOL_PING = 1
+    # Close and reopen a connection after this many checkouts
+    POOL_MAX_USAGE = 1000
+
     def __init__(self, env_file: Optional[Path] = None):
         """
         Initialize the database manager
@@ -21,7 +88,8 @@ class DatabaseManager:
         Args:
             env_file (Optional[Path]): Path to the .env file. If None, looks in current directory
         """
-        self.connections = {}
+        self.pools = {}
+        self._pools_lock = threading.Lock()
         # Load environment variables
         if env_file:
             if not env_file.exists():
@@ -43,7 +111,7 @@ class DatabaseManager:
                     'password': os.getenv('RAW_DB_PASSWORD'),
                     'database': os.getenv('RAW_DB_NAME'),
                     'port': int(os.getenv('RAW_DB_PORT')),
-                    'cursorclass': pymysql.cursors.DictCursor,
+                    'cursorclass': DictCursor,
                     'charset': 'utf8mb4'
                 },
                 'svenn_products': {
@@ -52,94 +120,243 @@ class DatabaseManager:
                     'password': os.getenv('SVENN_DB_PASSWORD'),
                     'database': os.getenv('SVENN_DB_NAME'),
                     'port': int(os.getenv('SVENN_DB_PORT')),
-                    'cursorclass': pymysql.cursors.DictCursor,
+                    'cursorclass': DictCursor,
                     'charset': 'utf8mb4'
                 }
             }
 
+            # Optional transport settings:
+            #   RAW_DB_UNIX_SOCKET - socket path when raw_data runs on this host
+            #   SVENN_DB_COMPRESS  - 'true' to compress svenn_products traffic,
+            #                        worthwhile for bulk writes over a WAN link
+            raw_db_socket = os.getenv('RAW_DB_UNIX_SOCKET')
+            if raw_db_socket:
+                self.db_configs['raw_data']['unix_socket'] = raw_db_socket
+            if os.getenv('SVENN_DB_COMPRESS', '').lower() in ('1', 'true', 'yes'):
+                self.db_configs['svenn_products']['compress'] = True
+
             # Validate all required environment variables are present
-            self._validate_configs()
+            for db_name, config in self.db_configs.items():
+                missing_fields = [field for field in self.REQUIRED_CONFIG_FIELDS if not config[field]]
+                if missing_fields:
+                    raise ValueError(
+                        f"Missing required configuration fields for {db_name}: {', '.join(missing_fields)}"
+                    )
 
         except Exception as e:
             logger.error(f"Failed to initialize database configurations: {e}")
             raise
 
-    def _validate_configs(self):
-        """Validate that all required configuration values are present"""
-        required_fields = ['host', 'user', 'database', 'port']
+    def shares_server(self, db_name: str, other_db_name: str) -> bool:
+        """Check whether two configured databases are on the same MySQL server"""
+        keys = ('host', 'port', 'unix_socket')
+        config, other = self.db_configs[db_name], self.db_configs[other_db_name]
+        return all(config.get(key) == other.get(key) for key in keys)
+
+    @staticmethod
+    def _driver_config(config: Dict[str, Any]) -> Dict[str, Any]:
+        """Translate a database configuration to the driver's connect() arguments"""
+        if db_driver.__name__ != 'MySQLdb':
+            if config.get('compress'):
+                # PyMySQL doesn't implement the compressed protocol
+                logger.warning("Protocol compression requires mysqlclient; connecting uncompressed")
+                config = {key: value for key, value in config.items() if key != 'compress'}
+            return config
+        # mysqlclient spells these passwd/db
+        renames = {'password': 'passwd', 'database': 'db'}
+        return {renames.get(key, key): value for key, value in config.items()}
+
+    def get_pool(self, db_name: str) -> PooledDB:
+        """Get the connection pool for a database, creating it on first use"""
+        if db_name not in self.db_configs:
+            raise KeyError(f"No configuration found for database: {db_name}")
+
+        with self._pools_lock:
+            if db_name not in self.pools:
+                try:
+                    self.pools[db_name] = PooledDB(
+                        creator=db_driver,
+                        **self.POOL_SIZES[db_name],
+                        maxusage=self.POOL_MAX_USAGE,
+                        blocking=True,
+                        ping=self.POOL_PING,
+                        **self._driver_config(self.db_configs[db_name])
+                    )
+                except db_driver.Error as e:
+                    logger.error(f"Failed to connect to {db_name}: {e}")
+                    raise
 
-        for db_name, config in self.db_configs.items():
-            missing_fields = [field for field in required_fields if not config.get(field)]
-            if missing_fields:
-                raise ValueError(
-                    f"Missing required configuration fields for {db_name}: {', '.join(missing_fields)}"
-                )
+        return self.pools[db_name]
 
-    def get_connection(self, db_name: str) -> pymysql.Connection:
+    def get_connection(self, db_name: str):
         """
-        Get a database connection for the specified database
+        Get a pooled database connection for the specified database
+
+        Closing the returned connection hands it back to the pool.
 
         Args:
             db_name (str): Name of the database configuration to use
 
         Returns:
-            pymysql.Connection: Database connection
+            Pooled database connection
 
         Raises:
             KeyError: If database configuration not found
-            pymysql.Error: If connection fails
+            db_driver.Error: If connection fails
         """
-        if db_name not in self.db_configs:
-            raise KeyError(f"No configuration found for database: {db_name}")
-
-        if db_name not in self.connections or not self.connections[db_name].open:
-            try:
-                self.connections[db_name] = pymysql.connect(**self.db_configs[db_name])
-            except pymysql.Error as e:
-                logger.error(f"Failed to connect to {db_name}: {e}")
-                raise
-
-        return self.connections[db_name]
+        return self.get_pool(db_name).connection()
 
     @contextmanager
     def get_cursor(self, db_name: str):
         """Context manager for database cursor"""
-        conn = self.get_connection(db_name)
-        cursor = None
-        try:
-            cursor = conn.cursor()
-            yield cursor
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database operation failed for {db_name}: {e}")
-            raise
-        finally:
-            if cursor:
-                cursor.close()
+        with self.get_connection(db_name) as conn:
+            cursor = None
+            try:
+                cursor = conn.cursor()
+                yield cursor
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Database operation failed for {db_name}: {e}")
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
 
     def close_all_connections(self):
-        """Close all database connections"""
-        for db_name, conn in self.connections.items():
-            if conn and conn.open:
-                conn.close()
-        self.connections.clear()
+        """Close all database connection pools"""
+        with self._pools_lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
 
     @contextmanager
-    def transaction(self, db_name: str):
-        """Context manager for database transactions"""
+    def transaction(self, db_name: str, bulk_import: bool = False):
+        """
+        Context manager for database transactions
+
+        Connections run with autocommit off, so everything executed on the
+        cursor is one transaction: committed when the block exits normally
+        and rolled back if it raises.
+
+        With bulk_import, foreign key checks are turned off for the
+        transaction, for bulk writes whose referenced ids were just looked
+        up. Unique checks stay on: the upserts rely on them.
+        """
         with self.get_cursor(db_name) as cursor:
+            if not bulk_import:
+                yield cursor
+                return
+
+            cursor.execute("SET SESSION foreign_key_checks = 0")
             try:
-                cursor.execute("START TRANSACTION")
                 yield cursor
-                cursor.execute("COMMIT")
-            except Exception as e:
-                cursor.execute("ROLLBACK")
-                logger.error(f"Transaction failed for {db_name}: {e}")
-                raise
+            finally:
+                # Restore the default before the connection goes back to the pool
+                try:
+                    cursor.execute("SET SESSION foreign_key_checks = 1")
+                except db_driver.Error as e:
+                    logger.warning(f"Failed to restore foreign key checks for {db_name}: {e}")
+
+    def analyze_tables(self, db_name: str, tables: Sequence[str]) -> None:
+        """Refresh the index statistics of tables, e.g. after a bulk import"""
+        if not tables:
+            return
+        with self.get_cursor(db_name) as cursor:
+            cursor.execute(f"ANALYZE TABLE {', '.join(tables)}")
+            cursor.fetchall()
 
     def execute_query(self, db_name: str, query: str, params: Optional[tuple] = None) -> Any:
         """Execute a query and return results"""
         with self.get_cursor(db_name) as cursor:
             cursor.execute(query, params)
-            return cursor.fetchall()
\ No newline at end of file
+            return cursor.fetchall()
+
+    def stream_query(self, db_name: str, query: str, params: Optional[tuple] = None,
+                     arraysize: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Execute a query and yield rows as the server sends them
+
+        Uses an unbuffered (server-side) cursor, so only the rows currently
+        being consumed are held in memory. Rows are read arraysize at a time.
+        The connection stays checked out of the pool until the generator is
+        exhausted or closed.
+        """
+        with self.get_connection(db_name) as conn:
+            cursor = conn.cursor(SSDictCursor)
+            try:
+                cursor.execute(query, params)
+                while rows := cursor.fetchmany(arraysize):
+                    yield from rows
+            finally:
+                cursor.close()
+
+    def load_ean_index(self) -> Dict[str, int]:
+        """
+        Load the product_id of every EAN code in svenn_products
+
+        The table is streamed, so only the resulting dict is held in memory.
+        Used by processors that look up many EANs to replace per-batch
+        lookup queries.
+
+        Returns:
+            Dict[str, int]: product_id by EAN code
+        """
+        rows = self.stream_query('svenn_products', "SELECT ean_code, product_id FROM ean_codes")
+        return {str(row['ean_code']): row['product_id'] for row in rows}
+
+    def fetch_keyset_pages(self, db_name: str, query: str, key: str,
+                           page_size: int) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Fetch a query's rows page by page using keyset pagination
+
+        The query must select `key` (a unique, indexed column) and leave its
+        filter to a {where} placeholder, e.g. "SELECT id, name FROM t WHERE {where}".
+        Every page is a short query continuing after the last key seen, so
+        no connection is held while the caller works on a page.
+
+        Args:
+            db_name: Name of the database configuration to use
+            query: SELECT statement with a {where} placeholder
+            key: Column to order and paginate by
+            page_size: Maximum number of rows per page
+        """
+        last_key = None
+        while True:
+            if last_key is None:
+                sql, params = query.format(where='TRUE'), ()
+            else:
+                sql, params = query.format(where=f'{key} > %s'), (last_key,)
+
+            rows = list(self.execute_query(db_name, f"{sql} ORDER BY {key} LIMIT %s", params + (page_size,)))
+            if not rows:
+                return
+            yield rows
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][key]
+
+
+# DatabaseManager shared by everything running in this process (the Flask
+# app and its scheduled jobs), created on first use
+_shared_manager: Optional[DatabaseManager] = None
+_shared_manager_lock = threading.Lock()
+
+
+def get_shared_manager(env_file: Path) -> DatabaseManager:
+    """
+    Return the process-wide DatabaseManager, creating it on first use
+
+    Its connection pools live as long as the process, so scheduled runs
+    reuse open connections instead of connecting (and authenticating) on
+    every run. Callers must not close it.
+
+    Args:
+        env_file: .env file to configure the manager from; only used by
+            the call that creates it
+    """
+    global _shared_manager
+    with _shared_manager_lock:
+        if _shared_manager is None:
+            _shared_manager = DatabaseManager(env_file)
+    return _shared_manager
@@ -0,0 +1,120 @@
+# app/jobs/runner.py
+"""
+Run the processors of several warehouses side by side, outside the scheduler
+
+Usage: python -m app.jobs.runner [--env PATH] [warehouse ...]
+
+Warehouses are independent of each other (each writes its own retailer's
+data), so each one runs in its own process with its own DatabaseManager.
+The processors of a single warehouse keep their order and run inside that
+warehouse's process.
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import List
+
+from app.jobs.utils.logging_config import setup_script_logging
+
+WAREHOUSE_SCRIPTS_DIR = Path(__file__).resolve().parent / 'warehouse_scripts'
+
+logger = setup_script_logging('runner')
+
+
+def discover_warehouses() -> List[str]:
+    """Names of the warehouse packages that provide run_all_processors"""
+    return sorted(
+        entry.name for entry in os.scandir(WAREHOUSE_SCRIPTS_DIR)
+        if entry.is_dir() and (Path(entry.path) / '__init__.py').exists()
+    )
+
+
+def run_warehouse(warehouse: str, env_path: str) -> None:
+    """
+    Run all processors of a warehouse
+
+    Top-level so it can be sent to a worker process: connections can't be
+    shared across processes, so every call creates its own DatabaseManager.
+
+    Args:
+        warehouse: Name of the warehouse package (e.g. 'byggmakker')
+        env_path: Path to the environment file
+    """
+    from app.jobs.common.database_manager import DatabaseManager
+
+    package = importlib.import_module(f'app.jobs.warehouse_scripts.{warehouse}')
+    db_manager = DatabaseManager(Path(env_path))
+    try:
+        package.run_all_processors(db_manager)
+    finally:
+        db_manager.close_all_connections()
+
+
+def run_warehouses(warehouses: List[str], env_path: Path) -> bool:
+    """
+    Run the warehouses concurrently, one process each
+
+    Workers are spawned rather than forked: a forked child would inherit the
+    log queue without the listener thread that drains it, and would exit
+    without running the atexit hook that flushes it. A spawned child sets
+    up its own logging on import.
+
+    Returns:
+        bool: True if every warehouse finished without raising
+    """
+    succeeded = True
+    max_workers = min(len(warehouses), os.cpu_count() or 1)
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')
+    ) as executor:
+        futures = {
+            executor.submit(run_warehouse, warehouse, str(env_path)): warehouse
+            for warehouse in warehouses
+        }
+        for future in as_completed(futures):
+            warehouse = futures[future]
+            try:
+                future.result()
+                logger.info("Warehouse %s completed", warehouse)
+            except Exception as e:
+                logger.error("Warehouse %s failed: %s", warehouse, e)
+                succeeded = False
+    return succeeded
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description="Run warehouse processors concurrently.")
+    parser.add_argument(
+        "warehouses",
+        nargs="*",
+        help="Warehouses to run (default: all)"
+    )
+    parser.add_argument(
+        "--env",
+        type=str,
+        default=str(Path(os.getcwd()) / '.env'),
+        help="Path to the environment file"
+    )
+    args = parser.parse_args()
+
+    env_path = Path(args.env)
+    if not env_path.exists():
+        raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
+
+    available = discover_warehouses()
+    unknown = set(args.warehouses) - set(available)
+    if unknown:
+        parser.error(f"Unknown warehouse(s): {', '.join(sorted(unknown))}")
+
+    warehouses = args.warehouses or available
+    logger.info("Running warehouses: %s", ', '.join(warehouses))
+    if not run_warehouses(warehouses, env_path):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,58 @@
 # app/jobs/scheduler.py
 import sys
+import threading
+import time
 import importlib.util
 from datetime import datetime
+from functools import lru_cache
+from types import ModuleType
+from typing import Dict, Tuple
 
 from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.cron import CronTrigger
 from flask import current_app
+from sqlalchemy.orm import selectinload
 from app import db, scheduler
 from app.models import Job, JobExecution
 from pathlib import Path
 from app.jobs.utils.logging_config import setup_script_logging
-from app.jobs.common.database_manager import DatabaseManager
+from app.jobs.common.database_manager import DatabaseManager, get_shared_manager
 
 logger = setup_script_logging('scheduler')
 
+# Imported warehouse scripts keyed by (warehouse, script_name), stored
+# together with the file mtime they were loaded from
+_SCRIPT_CACHE: Dict[Tuple[str, str], Tuple[float, ModuleType]] = {}
+
+# Flask app shared by every job run, created on first use
+_app = None
+_shared_lock = threading.Lock()
+
+
+def _get_app():
+    """Return the Flask app jobs run in, creating it on the first run only"""
+    global _app
+    with _shared_lock:
+        if _app is None:
+            from app import create_app
+            _app = create_app()
+    return _app
+
+
+def _get_db_manager(env_path: Path) -> DatabaseManager:
+    """Return the process-wide DatabaseManager, checking the .env file first"""
+    if not env_path.exists():
+        raise FileNotFoundError(f"Environment file not found: {env_path}")
+    return get_shared_manager(env_path)
+
 
 def import_warehouse_script(warehouse: str, script_name: str):
     """
     Dynamically import a warehouse script
 
+    Loaded modules are cached per (warehouse, script) and only re-executed
+    when the script file's modification time changes.
+
     Args:
         warehouse: Name of the warehouse (e.g., 'byggmakker')
         script_name: Name of the script file without .py extension
@@ -27,11 +62,18 @@ def import_warehouse_script(warehouse: str, script_name: str):
         script_path = Path(current_app.config['JOBS_FOLDER']) / 'warehouse_scripts' / warehouse / f"{script_name}.py"
         script_path = script_path.resolve()  # Resolve to absolute path
 
-        logger.info(f"Attempting to import script from: {script_path}")
-
-        if not script_path.exists():
+        try:
+            mtime = script_path.stat().st_mtime
+        except FileNotFoundError:
             raise FileNotFoundError(f"Script file not found: {script_path}")
 
+        key = (warehouse, script_name)
+        cached = _SCRIPT_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        logger.info("Attempting to import script from: %s", script_path)
+
         # Import the module
         spec = importlib.util.spec_from_file_location(
             f"{warehouse}_{script_name}",
@@ -40,23 +82,33 @@ def import_warehouse_script(warehouse: str, script_name: str):
         module = importlib.util.module_from_spec(spec)
         sys.modules[spec.name] = module
         spec.loader.exec_module(module)
+        _SCRIPT_CACHE[key] = (mtime, module)
         return module
 
     except Exception as e:
-        logger.error(f"Failed to import script {script_name} from {warehouse}: {e}")
+        logger.error("Failed to import script %s from %s: %s", script_name, warehouse, e)
         raise
 
 
-def execute_script(job_id: int):
-    """Execute a script and log its execution"""
+def execute_script(job_id: int = None, script_id: int = None):
+    """
+    Execute a script and log its execution
+
+    Args:
+        job_id: ID of the scheduled job to run
+        script_id: ID of a script to run directly, without a job (used when
+            job_id is not given)
+    """
     from flask import current_app
-    logger.info(f"Starting script execution for job ID: {job_id}")
+    if job_id is not None:
+        logger.info("Starting script execution for job ID: %s", job_id)
+    else:
+        logger.info("Starting script execution for script ID: %s", script_id)
     execution = None
-    db_manager = None
+    started = time.perf_counter()
 
     # Get the Flask app instance
-    from app import create_app
-    app = create_app()
+    app = _get_app()
 
     # Run everything within the application context
     with app.app_context():
@@ -64,47 +116,50 @@ def execute_script(job_id: int):
             logger.info("Created application context")
 
             # Get job details
-            job = Job.query.get(job_id)
-            if not job:
-                raise ValueError(f"Job {job_id} not found")
-            logger.info(f"Found job: {job.script.filename}")
+            if job_id is not None:
+                job = Job.query.get(job_id)
+                if not job:
+                    raise ValueError(f"Job {job_id} not found")
+                script = job.script
+                logger.info("Found job: %s", script.filename)
+            else:
+                from app.models import Script
+                job = None
+                script = Script.query.get(script_id)
+                if not script:
+                    raise ValueError(f"Script {script_id} not found")
+                logger.info("Found script: %s", script.filename)
 
             # Parse warehouse and script name from filename
-            parts = job.script.filename.split('/')
+            parts = script.filename.split('/')
             if len(parts) != 2:
-                raise ValueError(f"Invalid script filename format: {job.script.filename}")
+                raise ValueError(f"Invalid script filename format: {script.filename}")
 
             warehouse, script_file = parts[0], parts[1]
             script_name = script_file.replace('.py', '')
-            logger.info(f"Parsed script info - warehouse: {warehouse}, script: {script_name}")
+            logger.info("Parsed script info - warehouse: %s, script: %s", warehouse, script_name)
 
             # Create execution record
             execution = JobExecution(
-                job_id=job.id,
+                job_id=job.id if job else None,
                 start_time=datetime.utcnow(),
                 status='running'
             )
             db.session.add(execution)
             db.session.commit()
-            logger.info(f"Created execution record with ID: {execution.id}")
-
-            # Initialize DatabaseManager with root .env file
-            env_path = Path(app.root_path).parent / '.env'
-            logger.info(f"Looking for .env file at: {env_path}")
-
-            if not env_path.exists():
-                raise FileNotFoundError(f"Environment file not found: {env_path}")
+            logger.info("Created execution record with ID: %s", execution.id)
 
-            db_manager = DatabaseManager(env_path)
-            logger.info("DatabaseManager initialized successfully")
+            # Scripts run on the process-wide DatabaseManager, configured
+            # from the project's root .env file
+            db_manager = _get_db_manager(Path(app.root_path).parent / '.env')
 
             # Import and execute script
             script_module = import_warehouse_script(warehouse, script_name)
-            logger.info(f"Successfully imported script: {job.script.filename}")
+            logger.info("Successfully imported script: %s", script.filename)
 
             if hasattr(script_module, 'main'):
                 logger.info("Found main() function in script, executing...")
-                script_module.main()
+                script_module.main(db_manager)
                 logger.info("Script execution completed successfully")
                 execution.status = 'completed'
             else:
@@ -123,14 +178,36 @@ def execute_script(job_id: int):
                 execution.end_time = datetime.utcnow()
                 try:
                     db.session.commit()
-                    logger.info(f"Execution record updated. Status: {execution.status}")
+                    logger.info(
+                        "Execution record updated. Status: %s (%.2f seconds)",
+                        execution.status, time.perf_counter() - started
+                    )
                 except Exception as e:
-                    logger.error(f"Failed to update execution record: {e}")
+                    logger.error("Failed to update execution record: %s", e)
                     db.session.rollback()
 
-            if db_manager:
-                logger.info("Closing database connections")
-                db_manager.close_all_connections()
+
+def run_script_once(script_id: int) -> str:
+    """
+    Queue a script for immediate execution on the scheduler's thread pool
+
+    No Job row is created; the execution record is stored without a job.
+
+    Args:
+        script_id: ID of the script to run
+
+    Returns:
+        str: APScheduler job ID of the queued run
+    """
+    # Without a trigger APScheduler runs the job once, right away
+    job = scheduler.add_job(
+        func=execute_script,
+        kwargs={'script_id': script_id},
+        id=f'run_now_{script_id}_{time.time_ns()}',
+        misfire_grace_time=60
+    )
+    logger.info("Queued script for immediate execution: %s", job.id)
+    return job.id
 
 
 def add_job(script_id: int, cron_expression: str) -> Job:
@@ -163,10 +240,9 @@ def add_job(script_id: int, cron_expression: str) -> Job:
         # Add job to APScheduler
         job = scheduler.add_job(
             func=execute_script,
-            trigger='cron',
+            trigger=_build_trigger(cron_expression),
             args=[script_id],
-            id=f'script_{script_id}',
-            **parse_cron_expression(cron_expression)
+            id=f'script_{script_id}'
         )
 
         # Create job record in database
@@ -177,12 +253,12 @@ def add_job(script_id: int, cron_expression: str) -> Job:
         )
         db.session.add(db_job)
         db.session.commit()
-        logger.info(f"Successfully added job for script: {script.filename}")
+        logger.info("Successfully added job for script: %s", script.filename)
 
         return db_job
 
     except Exception as e:
-        logger.error(f"Failed to add job: {e}", exc_info=True)
+        logger.error("Failed to add job: %s", e, exc_info=True)
         raise
 
 
@@ -194,7 +270,8 @@ def remove_job(job_id: int):
         job_id: ID of the job to remove
     """
     try:
-        job = Job.query.get(job_id)
+        # Deleting the job detaches its executions, so load them in one query
+        job = db.session.get(Job, job_id, options=[selectinload(Job.executions)])
         if not job:
             raise ValueError("Job not found")
 
@@ -202,20 +279,32 @@ def remove_job(job_id: int):
         try:
             scheduler.remove_job(job.job_id)
         except JobLookupError:
-            logger.warning(f"Job {job.job_id} not found in APScheduler - might have been lost after restart")
+            logger.warning("Job %s not found in APScheduler - might have been lost after restart", job.job_id)
             # Continue with database removal even if APScheduler job is not found
 
         # Remove from database
         db.session.delete(job)
         db.session.commit()
-        logger.info(f"Successfully removed job ID: {job_id}")
+        logger.info("Successfully removed job ID: %s", job_id)
 
     except Exception as e:
-        logger.error(f"Failed to remove job: {e}", exc_info=True)
+        logger.error("Failed to remove job: %s", e, exc_info=True)
         db.session.rollback()
         raise
 
 
+_CRON_FIELDS = ('minute', 'hour', 'day', 'month', 'day_of_week')
+
+
+@lru_cache(maxsize=256)
+def _split_cron_expression(expression: str) -> Tuple[str, ...]:
+    """Split and validate a cron expression, cached per expression"""
+    parts = tuple(expression.split())
+    if len(parts) != 5:
+        raise ValueError("Invalid cron expression. Expected format: 'minute hour day month day_of_week'")
+    return parts
+
+
 def parse_cron_expression(expression: str) -> dict:
     """
     Parse cron expression into APScheduler kwargs
@@ -226,17 +315,18 @@ def parse_cron_expression(expression: str) -> dict:
     Returns:
         dict: APScheduler compatible keyword arguments
     """
-    parts = expression.split()
-    if len(parts) != 5:
-        raise ValueError("Invalid cron expression. Expected format: 'minute hour day month day_of_week'")
+    return dict(zip(_CRON_FIELDS, _split_cron_expression(expression)))
 
-    return {
-        'minute': parts[0],
-        'hour': parts[1],
-        'day': parts[2],
-        'month': parts[3],
-        'day_of_week': parts[4]
-    }
+
+@lru_cache(maxsize=256)
+def _build_trigger(expression: str) -> CronTrigger:
+    """
+    Build the APScheduler trigger for a cron expression
+
+    CronTrigger holds no per-job state, so one instance is shared by every
+    job using the same expression.
+    """
+    return CronTrigger(**parse_cron_expression(expression))
 
 
 def toggle_job(job_id: int) -> bool:
@@ -270,10 +360,9 @@ def toggle_job(job_id: int) -> bool:
                 # If job not in scheduler (e.g., after restart), recreate it
                 scheduler.add_job(
                     func=execute_script,
-                    trigger='cron',
+                    trigger=_build_trigger(job.cron_expression),
                     args=[job_id],
-                    id=job.job_id,
-                    **parse_cron_expression(job.cron_expression)
+                    id=job.job_id
                 )
         else:
             # Pause job in APScheduler
@@ -287,7 +376,7 @@ def toggle_job(job_id: int) -> bool:
         return job.enabled
 
     except Exception as e:
-        logger.error(f"Failed to toggle job {job_id}: {e}")
+        logger.error("Failed to toggle job %s: %s", job_id, e)
         db.session.rollback()
         raise
 
@@ -313,27 +402,22 @@ def update_job(job_id: int, cron_expression: str = None) -> Job:
             raise ValueError(f"Job {job_id} not found")
 
         if cron_expression:
-            # Validate cron expression by attempting to parse it
+            # Validate cron expression by attempting to build its trigger
             try:
-                cron_kwargs = parse_cron_expression(cron_expression)
+                trigger = _build_trigger(cron_expression)
             except ValueError as e:
                 raise ValueError(f"Invalid cron expression: {e}")
 
             # Update job in APScheduler
             try:
-                scheduler.reschedule_job(
-                    job.job_id,
-                    trigger='cron',
-                    **cron_kwargs
-                )
+                scheduler.reschedule_job(job.job_id, trigger=trigger)
             except JobLookupError:
                 # If job not in scheduler (e.g., after restart), recreate it
                 scheduler.add_job(
                     func=execute_script,
-                    trigger='cron',
+                    trigger=trigger,
                     args=[job_id],
-                    id=job.job_id,
-                    **cron_kwargs
+                    id=job.job_id
                 )
 
             # Update cron expression in database
@@ -343,6 +427,6 @@ def update_job(job_id: int, cron_expression: str = None) -> Job:
         return job
 
     except Exception as e:
-        logger.error(f"Failed to update job {job_id}: {e}")
+        logger.error("Failed to update job %s: %s", job_id, e)
         db.session.rollback()
         raise
\ No newline at end of file
@@ -1,8 +1,48 @@
 # In app/jobs/utils/logging_config.py
 
+import atexit
 import logging
 import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_FILE = Path(__file__).parent.parent.parent / 'logs' / 'script_executions.log'
+
+# Every script/processor logger shares one QueueHandler. Emitting a record is
+# just a queue push; a single QueueListener thread does the console and file
+# writes, so per-record logging never blocks on disk I/O
+_FORMATTER = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+_log_queue: queue.Queue = queue.Queue(-1)
+_queue_handler = QueueHandler(_log_queue)
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def get_queue_handler() -> QueueHandler:
+    """Return the shared queue handler, starting the background listener on first use"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            # Ensure logs directory exists
+            os.makedirs(LOG_FILE.parent, exist_ok=True)
+
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(_FORMATTER)
+            file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+            file_handler.setFormatter(_FORMATTER)
+
+            _listener = QueueListener(
+                _log_queue, console_handler, file_handler, respect_handler_level=True
+            )
+            _listener.start()
+            # Flush whatever is still queued when the process exits
+            atexit.register(_listener.stop)
+    return _queue_handler
 
 
 def setup_script_logging(script_name: str, log_level: int = logging.INFO) -> logging.Logger:
@@ -19,34 +59,20 @@ def setup_script_logging(script_name: str, log_level: int = logging.INFO) -> log
     logger = logging.getLogger(script_name)
     logger.setLevel(log_level)
 
-    # Remove any existing handlers
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
-
-    # Create formatter with standardized timestamp format
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                                  '%Y-%m-%d %H:%M:%S')
-
-    # Console Handler
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    # The handler is shared, so a logger configured here needs nothing more
+    if getattr(logger, '_svenn_configured', False):
+        return logger
 
-    # File Handler
     try:
-        # Ensure logs directory exists
-        log_dir = Path(__file__).parent.parent.parent / 'logs'
-        os.makedirs(log_dir, exist_ok=True)
-
-        log_file = log_dir / 'script_executions.log'
-        file_handler = logging.FileHandler(str(log_file), encoding='utf-8')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-
-        logger.info(f"Logging initialized for {script_name}")
+        logger.addHandler(get_queue_handler())
+        # Records are written by our own handler; don't emit them again
+        # through whatever the root logger has configured
+        logger.propagate = False
+        logger._svenn_configured = True
+        logger.info("Logging initialized for %s", script_name)
 
     except Exception as e:
-        logger.error(f"Failed to set up file logging: {e}")
+        logger.error("Failed to set up file logging: %s", e)
         raise
 
-    return logger
\ No newline at end of file
+    return logger
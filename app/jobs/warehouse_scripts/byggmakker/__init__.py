@@ -1,5 +1,7 @@
 # app/jobs/warehouse_scripts/byggmakker/__init__.py
 
+from concurrent.futures import ThreadPoolExecutor
+
 from .base_data import BaseByggmakkerProcessor
 from .store_data import StoreDataProcessor
 from .prices import StorePriceProcessor
@@ -21,6 +23,24 @@ __all__ = [
 ]
 
 
+# Processors grouped by dependency: processors within a stage are independent
+# of each other and run concurrently, and each stage waits for the previous one
+_PROCESSOR_STAGES = [
+    [BaseByggmakkerProcessor],
+    [StoreDataProcessor, RetailerByggmakkerProcessor],
+    [StorePriceProcessor],
+]
+
+
+def _run_processor(processor) -> None:
+    """Run a single processor, logging (not raising) any failure"""
+    try:
+        processor.process_all()
+    except Exception as e:
+        # Log error but continue with the other processors
+        processor.logger.error("Error running %s: %s", processor.__class__.__name__, e)
+
+
 def run_all_processors(db_manager):
     """
     Run all processors for Byggmakker warehouse in the correct order
@@ -28,20 +48,12 @@ def run_all_processors(db_manager):
     Args:
         db_manager: DatabaseManager instance for database connections
     """
-    processors = [
-        BaseByggmakkerProcessor(db_manager),
-        StoreDataProcessor(db_manager),
-        RetailerByggmakkerProcessor(db_manager),
-        StorePriceProcessor(db_manager)
-    ]
-
-    for processor in processors:
-        try:
-            processor.process_all()
-        except Exception as e:
-            # Log error but continue with next processor
-            processor.logger.error(f"Error running {processor.__class__.__name__}: {e}")
-            continue
+    max_workers = max(len(stage) for stage in _PROCESSOR_STAGES)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for stage in _PROCESSOR_STAGES:
+            processors = [processor_class(db_manager) for processor_class in stage]
+            # Drain the results so the whole stage finishes before the next starts
+            list(executor.map(_run_processor, processors))
 
 
 # Optional: Add any warehouse-specific utility functions here
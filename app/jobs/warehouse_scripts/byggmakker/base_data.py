@@ -1,17 +1,25 @@
 # app/jobs/warehouse_scripts/byggmakker/base_data.py
 
-from typing import Dict, Any, List, Optional
+import re
+from operator import itemgetter
+from typing import Dict, Any, Iterator, List, Optional
 from dataclasses import dataclass
 from pathlib import Path
-import json
+import orjson
 import argparse
 import os
-import flask
 from app.jobs.common.base_processor import BaseProcessor
-from app.jobs.common.database_manager import DatabaseManager
+from app.jobs.common.database_manager import DatabaseManager, execute_values
 from app.jobs.utils.logging_config import setup_script_logging
 
-@dataclass
+# 12-14 digit EAN/UPC/GTIN codes
+_EAN_RE = re.compile(r'[0-9]{12,14}')
+# Fields of a raw base data row (all selected by _fetch_raw_data), read in
+# one call per row
+_BASE_FIELDS = itemgetter('ean', 'name', 'sales_unit', 'comparison_price_unit', 'product_id', 'images')
+
+
+@dataclass(slots=True)
 class ProductData:
     """Data class for product information"""
     ean: str
@@ -24,6 +32,9 @@ class ProductData:
 class BaseByggmakkerProcessor(BaseProcessor):
     """Processes Byggmakker base data from raw database to svenn products database"""
 
+    DEDUP_KEY = 'ean'
+    BULK_IMPORT_TABLES = ('products', 'ean_codes', 'nobb_codes', 'product_images')
+
     def __init__(self, db_manager: DatabaseManager, batch_size: int = 100):
         """
         Initialize the processor with a database manager
@@ -35,8 +46,11 @@ class BaseByggmakkerProcessor(BaseProcessor):
         super().__init__(db_manager, batch_size)
         self.updated_count = 0
         self.created_count = 0
+        self.unchanged_count = 0
+        self.invalid_ean_count = 0
+        self.missing_data_count = 0
 
-    def _fetch_raw_data(self) -> List[Dict[str, Any]]:
+    def _fetch_raw_data(self) -> Iterator[Dict[str, Any]]:
         """Fetch data from raw_data database"""
         try:
             query = """
@@ -48,7 +62,7 @@ class BaseByggmakkerProcessor(BaseProcessor):
                 LEFT JOIN byggmakker_retailer_ecom_unit e ON b.ean = e.ean
                 WHERE b.ean IS NOT NULL
             """
-            return self.db_manager.execute_query('raw_data', query)
+            yield from self.db_manager.stream_query('raw_data', query)
         except Exception as e:
             self.logger.error(f"Failed to fetch raw data: {e}")
             raise
@@ -63,73 +77,204 @@ class BaseByggmakkerProcessor(BaseProcessor):
         Returns:
             Optional[str]: Validated EAN code or None if invalid
         """
-        try:
-            ean_str = str(ean_code).strip()
-            if not ean_str.isdigit():
-                self.logger.warning(f"Invalid EAN (non-digits): {ean_str}")
-                return None
-            if len(ean_str) not in [12, 13, 14]:
-                self.logger.warning(f"Invalid EAN length: {ean_str}")
-                return None
+        ean_str = str(ean_code).strip()
+        if _EAN_RE.fullmatch(ean_str):
             return ean_str
-        except (TypeError, ValueError) as e:
-            self.logger.warning(f"EAN validation failed: {e}")
+
+        # Invalid EANs are common in the feed: count them for the summary
+        # instead of warning on every row
+        self._stage_count('invalid_ean_count')
+        self.logger.debug("Invalid EAN: %s", ean_str)
+        return None
+
+    def _build_product_data(self, raw_product: Dict[str, Any]) -> Optional[ProductData]:
+        """
+        Validate a raw record and build its ProductData
+
+        Returns:
+            Optional[ProductData]: Product data, or None if the record is skipped
+        """
+        ean, name, unit, price_unit, nobb, images = _BASE_FIELDS(raw_product)
+        ean = self.validate_ean(ean)
+        if not ean:
             return None
 
-    def process_record(self, raw_product: Dict[str, Any]) -> None:
-        """Process a single product record"""
-        try:
-            ean = self.validate_ean(raw_product.get('ean'))
-            if not ean:
-                return
-
-            # Parse images from JSON string if needed
-            images = raw_product.get('images', '[]')
-            if isinstance(images, str):
-                try:
-                    images = json.loads(images)
-                except json.JSONDecodeError:
-                    images = []
-
-            product_data = ProductData(
-                ean=ean,
-                name=raw_product.get('name', ''),
-                unit=raw_product.get('sales_unit', ''),
-                price_unit=raw_product.get('comparison_price_unit', ''),
-                nobb=raw_product.get('product_id', ''),
-                images=images if isinstance(images, list) else []
-            )
+        # Parse images from JSON string if needed
+        if isinstance(images, (str, bytes)):
+            try:
+                images = orjson.loads(images)
+            except orjson.JSONDecodeError:
+                images = []
+
+        product_data = ProductData(
+            ean=ean,
+            name=name,
+            unit=unit,
+            price_unit=price_unit,
+            nobb=nobb,
+            images=images if isinstance(images, list) else []
+        )
+
+        if not all([product_data.name, product_data.unit, product_data.price_unit]):
+            self._stage_count('missing_data_count')
+            self.logger.debug("Skipping product with EAN %s: Missing required data", ean)
+            return None
 
-            if not all([product_data.name, product_data.unit, product_data.price_unit]):
-                self.logger.warning(f"Skipping product with EAN {ean}: Missing required data")
-                return
+        return product_data
 
-            self._process_product(product_data)
+    def process_record(self, raw_product: Dict[str, Any], cursor) -> None:
+        """Process a single product record"""
+        try:
+            product_data = self._build_product_data(raw_product)
+            if product_data:
+                self._process_product(cursor, product_data)
 
         except Exception as e:
             self.logger.error(f"Error processing product with EAN {raw_product.get('ean')}: {e}")
             raise
 
-    def _process_product(self, product_data: ProductData) -> None:
+    def process_records_bulk(self, batch: List[Dict[str, Any]], cursor) -> None:
+        """
+        Write a batch of products with a handful of multi-row statements
+
+        Existing products are found with one query and updated together;
+        new products are inserted row by row to get their ids, and their
+        EAN codes, NOBB codes and images are each inserted with one
+        multi-row INSERT. If the bulk write fails, the
+        batch is rolled back and retried record by record so only the bad
+        records are lost.
+
+        Args:
+            batch: Raw product records
+            cursor: Database cursor of the batch transaction
+        """
+        products: Dict[str, ProductData] = {}
+        for raw_product in batch:
+            product_data = self._build_product_data(raw_product)
+            if product_data:
+                # A later record for the same EAN wins
+                products[product_data.ean] = product_data
+
+        if not products:
+            self._commit_counts(processed=len(batch))
+            return
+
+        self._write_bulk_with_fallback(
+            batch, cursor, lambda: self._write_products(cursor, list(products.values()))
+        )
+
+    def _get_products_by_ean(self, cursor, ean_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch the stored base fields of products by EAN code with a single query"""
+        if not ean_codes:
+            return {}
+        cursor.execute("""
+            SELECT e.ean_code, e.product_id, p.base_name, p.base_unit, p.base_price_unit
+            FROM ean_codes e
+            JOIN products p ON p.product_id = e.product_id
+            WHERE e.ean_code IN %s
+        """, (tuple(ean_codes),))
+        return {str(row['ean_code']): row for row in cursor.fetchall()}
+
+    def _write_products(self, cursor, products: List[ProductData]) -> None:
+        """
+        Update existing and insert new products in bulk
+
+        Args:
+            cursor: Database cursor
+            products (List[ProductData]): Products to write, unique by EAN
+        """
+        existing = self._get_products_by_ean(cursor, [p.ean for p in products])
+
+        # Existing products are only updated if a base field has changed
+        updates = []
+        for p in products:
+            stored = existing.get(p.ean)
+            if stored is None:
+                continue
+            if (p.name, p.unit, p.price_unit) == (
+                    stored['base_name'], stored['base_unit'], stored['base_price_unit']):
+                self._stage_count('unchanged_count')
+                continue
+            updates.append((p.name, p.unit, p.price_unit, stored['product_id']))
+
+        if updates:
+            cursor.executemany("""
+                UPDATE products 
+                SET base_name = %s, base_unit = %s, base_price_unit = %s, updated = NOW()
+                WHERE product_id = %s
+            """, updates)
+
+        new_products = [p for p in products if p.ean not in existing]
+        if new_products:
+            product_ids = self._insert_products(cursor, new_products)
+
+            execute_values(cursor, """
+                INSERT INTO ean_codes (ean_code, product_id)
+                VALUES {values}
+            """, [(p.ean, product_id) for p, product_id in zip(new_products, product_ids)], "(%s, %s)")
+
+            execute_values(cursor, """
+                INSERT INTO nobb_codes (nobb_code, product_id)
+                VALUES {values}
+            """, [
+                (p.nobb, product_id)
+                for p, product_id in zip(new_products, product_ids) if p.nobb
+            ], "(%s, %s)")
+
+            execute_values(cursor, """
+                INSERT INTO product_images (product_id, image_url)
+                VALUES {values}
+            """, [
+                (product_id, image_url)
+                for p, product_id in zip(new_products, product_ids) for image_url in p.images
+            ], "(%s, %s)")
+
+        self._stage_count('updated_count', len(updates))
+        self._stage_count('created_count', len(new_products))
+        self.logger.info("Updated %d and inserted %d products", len(updates), len(new_products))
+
+    def _insert_products(self, cursor, products: List[ProductData]) -> List[int]:
+        """
+        Insert products one row at a time, reading each product_id from lastrowid
+
+        products has no natural key to read the new ids back by, and the ids
+        of a multi-row INSERT are only guaranteed consecutive under some
+        auto-increment lock modes, so each row gets its own INSERT. The EAN
+        codes, NOBB codes and images that reference them are still written
+        in bulk.
+
+        Returns:
+            List[int]: product_id of each product, in order
+        """
+        product_ids = []
+        for p in products:
+            cursor.execute("""
+                INSERT INTO products (base_name, base_unit, base_price_unit)
+                VALUES (%s, %s, %s)
+            """, (p.name, p.unit, p.price_unit))
+            product_ids.append(cursor.lastrowid)
+        return product_ids
+
+    def _process_product(self, cursor, product_data: ProductData) -> None:
         """
         Process a single product
 
         Args:
+            cursor: Database cursor
             product_data (ProductData): Product data to process
         """
         try:
-            with self.db_manager.transaction('svenn_products') as cursor:
-                # Check if product exists
-                cursor.execute(
-                    "SELECT product_id FROM ean_codes WHERE ean_code = %s",
-                    (product_data.ean,)
-                )
-                result = cursor.fetchone()
-
-                if result:
-                    self._update_product(cursor, product_data, result['product_id'])
-                else:
-                    self._insert_product(cursor, product_data)
+            # Check if product exists
+            cursor.execute(
+                "SELECT product_id FROM ean_codes WHERE ean_code = %s",
+                (product_data.ean,)
+            )
+            result = cursor.fetchone()
+
+            if result:
+                self._update_product(cursor, product_data, result['product_id'])
+            else:
+                self._insert_product(cursor, product_data)
 
         except Exception as e:
             self.logger.error(f"Error processing product {product_data.ean}: {e}")
@@ -149,8 +294,8 @@ class BaseByggmakkerProcessor(BaseProcessor):
             SET base_name = %s, base_unit = %s, base_price_unit = %s, updated = NOW()
             WHERE product_id = %s
         """, (product_data.name, product_data.unit, product_data.price_unit, product_id))
-        self.updated_count += 1
-        self.logger.info(f"Updated product: {product_data.ean}")
+        self._stage_count('updated_count')
+        self.logger.debug("Updated product: %s", product_data.ean)
 
     def _insert_product(self, cursor, product_data: ProductData) -> None:
         """
@@ -187,26 +332,44 @@ class BaseByggmakkerProcessor(BaseProcessor):
                 VALUES (%s, %s)
             """, (product_id, image_url))
 
-        self.created_count += 1
-        self.logger.info(f"Inserted new product: {product_data.ean}")
+        self._stage_count('created_count')
+        self.logger.debug("Inserted new product: %s", product_data.ean)
+
+    def _log_summary(self) -> None:
+        """Override base class log_summary to include product-specific stats"""
+        super()._log_summary()
+        self.logger.info("\nProduct Processing Details:")
+        self.logger.info("New products inserted: %d", self.created_count)
+        self.logger.info("Existing products updated: %d", self.updated_count)
+        self.logger.info("Existing products unchanged: %d", self.unchanged_count)
+        self.logger.info("Records skipped (invalid EAN): %d", self.invalid_ean_count)
+        self.logger.info("Records skipped (missing data): %d", self.missing_data_count)
 
-def main():
-    """Main execution function"""
+
+def main(db_manager: Optional[DatabaseManager] = None):
+    """
+    Main execution function
+
+    Args:
+        db_manager: DatabaseManager to run with, passed in by the scheduler;
+            standalone runs create their own from --env
+    """
     logger = setup_script_logging("base_byggmakker")
     logger.info("Starting base_byggmakker script")
 
-    # Check if running in Flask context
-    if flask.has_app_context():
-        logger.info("Running in Flask context")
-        env_path = Path(os.getcwd()) / '.env'
+    # The scheduler's manager (and its open connections) outlives the run
+    owns_manager = db_manager is None
+    if not owns_manager:
+        logger.info("Running with the scheduler's DatabaseManager")
         batch_size = 100
     else:
+        default_env_path = Path(os.getcwd()) / '.env'
         logger.info("Running in standalone mode")
         parser = argparse.ArgumentParser(description="Process Byggmakker data.")
         parser.add_argument(
             "--env",
             type=str,
-            default=str(Path(os.getcwd()) / '.env'),
+            default=str(default_env_path),
             help="Path to the environment file"
         )
         parser.add_argument(
@@ -219,15 +382,14 @@ def main():
         env_path = Path(args.env)
         batch_size = args.batch_size
 
-    db_manager = None
     try:
-        logger.info(f"Using env file at: {env_path.absolute()}")
-        if not env_path.exists():
-            logger.error(f"Environment file not found at: {env_path.absolute()}")
-            raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
-
-        db_manager = DatabaseManager(env_path)
-        logger.info("DatabaseManager initialized successfully")
+        if owns_manager:
+            logger.info(f"Using env file at: {env_path.absolute()}")
+            if not env_path.exists():
+                logger.error(f"Environment file not found at: {env_path.absolute()}")
+                raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
+            db_manager = DatabaseManager(env_path)
+            logger.info("DatabaseManager initialized successfully")
 
         # Initialize and run processor
         logger.info("Initializing BaseByggmakkerProcessor")
@@ -239,7 +401,7 @@ def main():
         logger.error(f"Script execution failed: {e}", exc_info=True)
         raise
     finally:
-        if db_manager:
+        if db_manager and owns_manager:
             logger.info("Closing database connections")
             db_manager.close_all_connections()
 
@@ -0,0 +1,36 @@
+# app/jobs/warehouse_scripts/byggmakker/bulk_sql.py
+
+# Server-side merges from raw_data into svenn_products. They run on the
+# svenn_products connection and read raw_data through its schema name, so
+# they only apply when both databases live on the same MySQL server.
+
+# Mirrors StorePriceProcessor's validation: prices must be positive, a
+# negative comparison price is stored as NULL, and rows whose EAN has no
+# product are skipped
+_STORE_PRICES_SOURCE = """
+    FROM `{raw_db}`.byggmakker_store_prices p
+    JOIN ean_codes ec ON ec.ean_code = CAST(p.ean AS CHAR)
+    WHERE p.store_id IS NOT NULL
+    AND p.price > 0
+"""
+
+MERGE_STORE_PRICES = """
+    INSERT INTO store_prices
+        (store_id, product_id, price, comparison_price, created, updated)
+    SELECT
+        p.store_id,
+        ec.product_id,
+        p.price,
+        CASE WHEN p.comparison_price >= 0 THEN p.comparison_price END,
+        NOW(),
+        NOW()
+""" + _STORE_PRICES_SOURCE + """
+    ON DUPLICATE KEY UPDATE
+        price = VALUES(price),
+        comparison_price = VALUES(comparison_price),
+        updated = NOW()
+"""
+
+# Number of source rows MERGE_STORE_PRICES writes; its rowcount counts an
+# updated row twice, so it can't stand in for the number of prices
+COUNT_STORE_PRICES = "SELECT COUNT(*) AS count" + _STORE_PRICES_SOURCE
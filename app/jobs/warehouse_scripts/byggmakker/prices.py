@@ -1,24 +1,49 @@
 # app/jobs/warehouse_scripts/byggmakker/prices.py
 
-from typing import Dict, Any, List, Optional
+import re
+import time
+from typing import Dict, Any, Iterator, List, Optional
 from dataclasses import dataclass
-from decimal import Decimal, InvalidOperation
+from pathlib import Path
+import os
 from app.jobs.common.base_processor import BaseProcessor
+from app.jobs.common.database_manager import DatabaseManager, is_lock_error
+from app.jobs.warehouse_scripts.byggmakker.bulk_sql import COUNT_STORE_PRICES, MERGE_STORE_PRICES
 from app.jobs.utils.logging_config import setup_script_logging
 
+# Plain non-negative decimal numbers, e.g. 129 or 129.90
+_PRICE_RE = re.compile(r'[0-9]+(?:\.[0-9]*)?|\.[0-9]+')
 
-@dataclass
+
+@dataclass(slots=True)
 class PriceData:
     """Data class for store price information"""
     ean: str
     store_id: str
-    price: Decimal
-    comparison_price: Optional[Decimal] = None
+    price: str
+    comparison_price: Optional[str] = None
 
 
 class StorePriceProcessor(BaseProcessor):
     """Processes store price data from raw database to svenn products database"""
 
+    PENDING_WRITE_SQL = """
+        INSERT INTO store_prices 
+            (store_id, product_id, price, comparison_price, created, updated)
+        VALUES {values}
+        ON DUPLICATE KEY UPDATE 
+            price = VALUES(price),
+            comparison_price = VALUES(comparison_price),
+            updated = NOW()
+    """
+    PENDING_WRITE_TEMPLATE = "(%s, %s, %s, %s, NOW(), NOW())"
+    # Price batches only read ean_codes and write store_prices, so they can
+    # be written in parallel
+    MAX_WORKERS = 4
+    BULK_IMPORT_TABLES = ('store_prices',)
+    # Attempts per batch when concurrent batches conflict on store_prices locks
+    LOCK_RETRIES = 3
+
     def __init__(self, db_manager):
         """
         Initialize the processor with a database manager
@@ -29,8 +54,69 @@ class StorePriceProcessor(BaseProcessor):
         super().__init__(db_manager)
         self.processed_count = 0
         self.error_count = 0
+        self.invalid_price_count = 0
+        self.missing_product_count = 0
+        self._ean_index: Dict[str, int] = {}
+
+    def process_all(self) -> None:
+        """
+        Process all price records
+
+        When raw_data and svenn_products share a server, all prices are
+        merged with a single INSERT ... SELECT; otherwise (or if that fails,
+        e.g. for lack of privileges on raw_data) they are processed in
+        batches
+        """
+        if self.db_manager.shares_server('raw_data', 'svenn_products'):
+            try:
+                self._merge_prices_server_side()
+                return
+            except Exception as e:
+                self.logger.warning("Server-side price merge failed, processing in batches: %s", e)
 
-    def _fetch_raw_data(self) -> List[Dict[str, Any]]:
+        # Every price needs its product_id and the same EANs recur for every
+        # store, so all of ean_codes is loaded once instead of queried per batch
+        self._ean_index = self.db_manager.load_ean_index()
+        super().process_all()
+
+    def _merge_prices_server_side(self) -> None:
+        """Upsert all store prices from raw_data with one statement"""
+        self.start_time = time.perf_counter()
+        self.logger.info("Starting %s server-side merge", self.__class__.__name__)
+
+        raw_db = self.db_manager.db_configs['raw_data']['database'].replace('`', '``')
+        with self.db_manager.transaction('svenn_products', bulk_import=True) as cursor:
+            cursor.execute(COUNT_STORE_PRICES.format(raw_db=raw_db))
+            self.processed_count = cursor.fetchone()['count']
+            cursor.execute(MERGE_STORE_PRICES.format(raw_db=raw_db))
+            # Inserted rows count once and updated rows twice
+            self.logger.info("Server-side merge affected %d rows", cursor.rowcount)
+
+        self._analyze_bulk_import_tables()
+        self._log_summary()
+
+    def process_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """
+        Process a batch, running it again if it loses a lock conflict
+
+        Batches write store_prices concurrently, and InnoDB resolves a
+        deadlock by rolling back one of the transactions, so the losing
+        batch is retried from the start after a short pause.
+        """
+        for attempt in range(1, self.LOCK_RETRIES + 1):
+            try:
+                super().process_batch(batch)
+                return
+            except Exception as e:
+                if attempt == self.LOCK_RETRIES or not is_lock_error(e):
+                    raise
+                self.logger.warning(
+                    "Price batch hit a lock conflict, retrying (%d/%d): %s",
+                    attempt, self.LOCK_RETRIES - 1, e
+                )
+                time.sleep(0.1 * attempt)
+
+    def _fetch_raw_data(self) -> Iterator[Dict[str, Any]]:
         """Fetch price data from raw_data database"""
         query = """
             SELECT ean, store_id, price, comparison_price
@@ -39,146 +125,225 @@ class StorePriceProcessor(BaseProcessor):
             AND store_id IS NOT NULL 
             AND price IS NOT NULL
         """
-        return self.db_manager.execute_query('raw_data', query)
+        return self.db_manager.stream_query('raw_data', query)
 
-    def _get_product_id_by_ean(self, cursor, ean_code: str) -> Optional[int]:
-        """Get product_id from ean_codes table"""
-        try:
-            cursor.execute(
-                "SELECT product_id FROM ean_codes WHERE ean_code = %s",
-                (ean_code,)
-            )
-            result = cursor.fetchone()
-            return result['product_id'] if result else None
-        except Exception as e:
-            self.logger.error(f"Error fetching product_id for EAN {ean_code}: {e}")
-            return None
-
-    def validate_price(self, price: Any) -> Optional[Decimal]:
+    def validate_price(self, price: Any) -> Optional[str]:
         """
-        Validate and convert price values
+        Validate price values
+
+        Prices are passed to MySQL as strings and converted by the DECIMAL
+        columns, so no Decimal is built per row.
 
         Args:
             price: The price value to validate
 
         Returns:
-            Optional[Decimal]: Validated price or None if invalid
+            Optional[str]: Validated price or None if invalid
         """
-        try:
-            if price is None:
-                return None
-            price_decimal = Decimal(str(price))
-            if price_decimal < 0:
-                self.logger.warning(f"Negative price value: {price}")
-                return None
-            return price_decimal
-        except (InvalidOperation, TypeError, ValueError) as e:
-            self.logger.warning(f"Invalid price value: {price}, error: {e}")
+        if price is None:
+            return None
+        price_str = str(price).strip()
+        if not _PRICE_RE.fullmatch(price_str):
+            self.logger.debug("Invalid price value: %s", price)
             return None
+        return price_str
 
-    def process_record(self, raw_price: Dict[str, Any]) -> None:
+    def process_record(self, raw_price: Dict[str, Any], cursor) -> None:
         """Process a single price record"""
-        try:
+        self.process_records_bulk([raw_price], cursor)
+
+    def process_records_bulk(self, batch: List[Dict[str, Any]], cursor) -> None:
+        """
+        Upsert a batch of price records
+
+        Product ids are taken from the EAN index loaded by process_all. Only
+        the last price per store/product pair is kept; pairs that already
+        have a price are updated with one UPDATE and the rest are written
+        with one multi-row INSERT.
+
+        Args:
+            batch: Raw price records
+            cursor: Database cursor of the batch transaction
+        """
+        prices = []
+        invalid_prices = 0
+        for raw_price in batch:
             # Validate price values
             price = self.validate_price(raw_price.get('price'))
             comparison_price = self.validate_price(raw_price.get('comparison_price'))
 
-            if not price:
-                self.logger.warning(f"Skipping record: Invalid price for EAN {raw_price.get('ean')}")
-                self.error_count += 1
-                return
+            # Zero prices count as invalid; strip('0.') only empties a zero
+            if not price or not price.strip('0.'):
+                self.logger.debug("Skipping record: Invalid price for EAN %s", raw_price.get('ean'))
+                invalid_prices += 1
+                continue
 
-            price_data = PriceData(
-                ean=raw_price['ean'],
+            prices.append(PriceData(
+                ean=str(raw_price['ean']),
                 store_id=raw_price['store_id'],
                 price=price,
                 comparison_price=comparison_price
-            )
+            ))
 
-            self._process_price_record(price_data)
+        missing_products = 0
+        product_ids = self._ean_index
+        for price_data in prices:
+            if not product_ids.get(price_data.ean):
+                self.logger.debug("No product_id found for EAN: %s", price_data.ean)
+                missing_products += 1
+        errors = invalid_prices + missing_products
 
-        except Exception as e:
-            self.logger.error(f"Error processing price record: {e}")
-            self.error_count += 1
-            raise
-
-    def _process_price_record(self, price_data: PriceData) -> None:
-        """
-        Process a single price record
+        if len(prices) == missing_products:
+            self._count_skipped(invalid_prices, missing_products)
+            self._add_counts(errors=errors)
+            return
 
-        Args:
-            price_data: Price data to process
-        """
+        cursor.execute("SAVEPOINT price_batch")
         try:
-            with self.db_manager.transaction('svenn_products') as cursor:
-                # Get product_id for the EAN
-                product_id = self._get_product_id_by_ean(cursor, price_data.ean)
+            for price_data in prices:
+                product_id = product_ids.get(price_data.ean)
                 if not product_id:
-                    self.logger.warning(f"No product_id found for EAN: {price_data.ean}")
-                    self.error_count += 1
-                    return
-
-                # Upsert price record
-                cursor.execute("""
-                    INSERT INTO store_prices 
-                        (store_id, product_id, price, comparison_price, created, updated)
-                    VALUES 
-                        (%s, %s, %s, %s, NOW(), NOW())
-                    ON DUPLICATE KEY UPDATE 
-                        price = VALUES(price),
-                        comparison_price = VALUES(comparison_price),
-                        updated = NOW()
-                """, (
+                    continue
+                # The last price for a store/product pair in the batch wins
+                self._buffer_write((price_data.store_id, product_id), (
                     price_data.store_id,
                     product_id,
                     price_data.price,
                     price_data.comparison_price
                 ))
-                self.processed_count += 1
-                self.logger.debug(f"Processed price for EAN {price_data.ean} in store {price_data.store_id}")
+
+            # Write in key order so concurrent batches take their row locks
+            # in the same order instead of deadlocking on each other
+            pending = self._pending
+            ordered = sorted(pending.items(), key=lambda item: (str(item[0][0]), item[0][1]))
+            pending.clear()
+            pending.update(ordered)
+
+            # Update existing and insert new price records
+            written = len(pending)
+            self._update_existing_prices(cursor)
+            self._flush_pending(cursor)
+            cursor.execute("RELEASE SAVEPOINT price_batch")
+            self._count_skipped(invalid_prices, missing_products)
+            self._add_counts(processed=written, errors=errors)
+            self.logger.debug("Processed %d prices", written)
 
         except Exception as e:
-            self.logger.error(f"Error processing price record for EAN {price_data.ean}: {e}")
-            self.error_count += 1
-            raise
+            self._pending.clear()
+            if is_lock_error(e):
+                # The transaction may already be rolled back; process_batch
+                # runs the whole batch again
+                raise
+            # Like a failing record, a failing batch is counted and skipped
+            cursor.execute("ROLLBACK TO SAVEPOINT price_batch")
+            self.logger.error("Error processing price batch: %s", e)
+            self._count_skipped(invalid_prices, missing_products)
+            self._add_counts(errors=errors + len(prices) - missing_products)
 
+    def _count_skipped(self, invalid_prices: int, missing_products: int) -> None:
+        """
+        Add to the skipped record counters from any worker thread
 
-def main():
-    """Main execution function"""
-    import os
-    import flask
-    from pathlib import Path
-    from app.jobs.common.database_manager import DatabaseManager
+        Called once a batch is done, so a batch retried after a lock
+        conflict isn't counted twice
+        """
+        with self._count_lock:
+            self.invalid_price_count += invalid_prices
+            self.missing_product_count += missing_products
 
+    def _update_existing_prices(self, cursor) -> None:
+        """
+        Update the queued prices that already exist and drop them from the queue
+
+        Most prices already exist, and updating them directly avoids an
+        insert attempt per row (and the auto-increment ids each one burns).
+        Each column is set with a CASE on the store/product pair, so all
+        existing prices are updated with a single statement. Rows left in
+        the queue are new and are flushed with PENDING_WRITE_SQL, which
+        still upserts in case another batch inserted the same pair first.
+
+        Args:
+            cursor: Database cursor
+        """
+        pending = self._pending
+        if not pending:
+            return
+
+        pairs = ', '.join(['(%s, %s)'] * len(pending))
+        cursor.execute(
+            f"SELECT store_id, product_id FROM store_prices WHERE (store_id, product_id) IN ({pairs})",
+            [value for key in pending for value in key]
+        )
+        existing = {(str(row['store_id']), row['product_id']) for row in cursor.fetchall()}
+        rows = [
+            pending.pop(key) for key in list(pending)
+            if (str(key[0]), key[1]) in existing
+        ]
+        if not rows:
+            return
+
+        arms = ' '.join(['WHEN store_id = %s AND product_id = %s THEN %s'] * len(rows))
+        pairs = ', '.join(['(%s, %s)'] * len(rows))
+        params = []
+        for index in (2, 3):  # price, comparison_price
+            for row in rows:
+                params.extend((row[0], row[1], row[index]))
+        for row in rows:
+            params.extend((row[0], row[1]))
+
+        cursor.execute(f"""
+            UPDATE store_prices
+            SET price = CASE {arms} END,
+                comparison_price = CASE {arms} END,
+                updated = NOW()
+            WHERE (store_id, product_id) IN ({pairs})
+        """, params)
+
+    def _log_summary(self) -> None:
+        """Override base class log_summary to include price-specific stats"""
+        super()._log_summary()
+        self.logger.info("\nPrice Processing Details:")
+        self.logger.info("Records skipped (invalid price): %d", self.invalid_price_count)
+        self.logger.info("Records skipped (no product for EAN): %d", self.missing_product_count)
+
+
+def main(db_manager: Optional[DatabaseManager] = None):
+    """
+    Main execution function
+
+    Args:
+        db_manager: DatabaseManager to run with, passed in by the scheduler;
+            standalone runs create their own from --env
+    """
     logger = setup_script_logging("store_prices")
     logger.info("Starting store_prices script")
 
-    # Check if running in Flask context
-    if flask.has_app_context():
-        logger.info("Running in Flask context")
-        env_path = Path(os.getcwd()) / '.env'
+    # The scheduler's manager (and its open connections) outlives the run
+    owns_manager = db_manager is None
+    if not owns_manager:
+        logger.info("Running with the scheduler's DatabaseManager")
     else:
+        default_env_path = Path(os.getcwd()) / '.env'
         import argparse
         logger.info("Running in standalone mode")
         parser = argparse.ArgumentParser(description="Process Byggmakker store prices.")
         parser.add_argument(
             "--env",
             type=str,
-            default=str(Path(os.getcwd()) / '.env'),
+            default=str(default_env_path),
             help="Path to the environment file"
         )
         args = parser.parse_args()
         env_path = Path(args.env)
 
-    db_manager = None
     try:
-        logger.info(f"Using env file at: {env_path.absolute()}")
-        if not env_path.exists():
-            logger.error(f"Environment file not found at: {env_path.absolute()}")
-            raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
-
-        db_manager = DatabaseManager(env_path)
-        logger.info("DatabaseManager initialized successfully")
+        if owns_manager:
+            logger.info(f"Using env file at: {env_path.absolute()}")
+            if not env_path.exists():
+                logger.error(f"Environment file not found at: {env_path.absolute()}")
+                raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
+            db_manager = DatabaseManager(env_path)
+            logger.info("DatabaseManager initialized successfully")
 
         # Initialize and run processor
         logger.info("Initializing StorePriceProcessor")
@@ -190,7 +355,7 @@ def main():
         logger.error(f"Script execution failed: {e}", exc_info=True)
         raise
     finally:
-        if db_manager:
+        if db_manager and owns_manager:
             logger.info("Closing database connections")
             db_manager.close_all_connections()
 
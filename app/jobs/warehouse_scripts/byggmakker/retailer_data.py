@@ -1,12 +1,27 @@
 # app/jobs/warehouse_scripts/byggmakker/retailer_data.py
 
-from typing import Dict, Any, List, Optional
+import re
+from operator import itemgetter
+from typing import Dict, Any, Iterator, List, Optional
 from dataclasses import dataclass
+from pathlib import Path
+import os
 from app.jobs.common.base_processor import BaseProcessor
+from app.jobs.common.database_manager import DatabaseManager, execute_values
 from app.jobs.utils.logging_config import setup_script_logging
 
 
-@dataclass
+# 12-14 digit EAN/UPC/GTIN codes
+_EAN_RE = re.compile(r'[0-9]{12,14}')
+# Runs of anything but ASCII letters and digits (dashes included) become
+# a single dash in product URL slugs
+_SLUG_RE = re.compile(r'[^a-zA-Z0-9]+')
+# Fields of a raw retailer row (all selected by _fetch_raw_data), read in
+# one call per row
+_RETAILER_FIELDS = itemgetter('ean', 'name', 'brand', 'category', 'sales_unit', 'comparison_price_unit')
+
+
+@dataclass(slots=True)
 class RetailerProduct:
     """Data class for retailer product information"""
     ean: str
@@ -21,7 +36,14 @@ class RetailerByggmakkerProcessor(BaseProcessor):
     """Processes Byggmakker retailer data from raw database to svenn products database"""
 
     RETAILER_ID = 1  # Hardcoded retailer_id for Byggmakker
+    DEDUP_KEY = 'ean'
+    BULK_IMPORT_TABLES = ('categories', 'retailers_products')
     BASE_URL = "https://www.byggmakker.no/produkt/"
+    # retailers_products columns written per product, in row tuple order
+    RETAILER_PRODUCT_COLUMNS = (
+        'variant_name', 'brand', 'category_id',
+        'retail_unit', 'retail_price_comparison_unit', 'url_product'
+    )
 
     def __init__(self, db_manager):
         """
@@ -33,8 +55,26 @@ class RetailerByggmakkerProcessor(BaseProcessor):
         super().__init__(db_manager)
         self.updated_count = 0
         self.created_count = 0
+        self.unchanged_count = 0
+        self.invalid_ean_count = 0
+        self.missing_data_count = 0
+        self.missing_product_count = 0
+        self.missing_category_count = 0
+        self._category_cache: Dict[str, int] = {}
+        self._ean_index: Dict[str, int] = {}
+
+    def process_all(self) -> None:
+        """
+        Process all retailer product records
+
+        Products are created by the base processor before this one runs, so
+        all of ean_codes is loaded once, before any batch transaction holds a
+        connection, instead of queried per batch
+        """
+        self._ean_index = self.db_manager.load_ean_index()
+        super().process_all()
 
-    def _fetch_raw_data(self) -> List[Dict[str, Any]]:
+    def _fetch_raw_data(self) -> Iterator[Dict[str, Any]]:
         """Fetch base product data from raw_data database"""
         query = """
             SELECT 
@@ -46,189 +86,361 @@ class RetailerByggmakkerProcessor(BaseProcessor):
             LEFT JOIN byggmakker_retailer_ecom_unit e ON b.ean = e.ean
             WHERE b.ean IS NOT NULL
         """
-        return self.db_manager.execute_query('raw_data', query)
+        return self.db_manager.stream_query('raw_data', query)
 
     def _get_product_id_by_ean(self, cursor, ean_code: str) -> Optional[int]:
-        """Get product_id from ean_codes table"""
-        cursor.execute(
-            "SELECT product_id FROM ean_codes WHERE ean_code = %s",
-            (ean_code,)
-        )
-        result = cursor.fetchone()
-        return result['product_id'] if result else None
+        """Get product_id from the EAN index"""
+        return self._get_product_ids_by_ean(cursor, [ean_code]).get(ean_code)
 
-    def _insert_or_update_category(self, cursor, category_name: str) -> Optional[int]:
-        """Insert or update category and return category_id"""
-        try:
-            # Check if category exists
-            cursor.execute(
-                "SELECT category_id FROM categories WHERE category_name = %s",
-                (category_name,)
-            )
-            result = cursor.fetchone()
-
-            if result:
-                return result['category_id']
+    def _ensure_categories(self, cursor, category_names) -> Dict[str, int]:
+        """
+        Make sure categories exist and return the name -> category_id cache
 
-            # Insert new category
-            cursor.execute(
-                "INSERT INTO categories (category_name) VALUES (%s)",
-                (category_name,)
+        Names not cached yet are looked up with one query; any still missing
+        are created with one multi-row INSERT and read back.
+        """
+        missing = {name for name in category_names if name not in self._category_cache}
+        if missing:
+            self._load_categories(cursor, missing)
+            missing = {name for name in missing if name not in self._category_cache}
+        if missing:
+            execute_values(
+                cursor,
+                "INSERT INTO categories (category_name) VALUES {values}",
+                [(name,) for name in {name.lower(): name for name in missing}.values()],
+                "(%s)"
             )
-            return cursor.lastrowid
+            self._load_categories(cursor, missing)
+        return self._category_cache
 
+    def _load_categories(self, cursor, category_names) -> None:
+        """Cache the category_ids of existing categories"""
+        cursor.execute(
+            "SELECT category_id, category_name FROM categories WHERE category_name IN %s",
+            (tuple(category_names),)
+        )
+        # Category names compare case-insensitively in MySQL, so match the
+        # rows back to the requested names the same way
+        found = {row['category_name'].lower(): row['category_id'] for row in cursor.fetchall()}
+        for name in category_names:
+            category_id = found.get(name.lower())
+            if category_id:
+                self._category_cache[name] = category_id
+
+    def _get_category_id(self, cursor, category_name: str) -> Optional[int]:
+        """Get the category_id for a name, creating the category if needed"""
+        try:
+            return self._ensure_categories(cursor, {category_name}).get(category_name)
         except Exception as e:
             self.logger.error(f"Error managing category {category_name}: {e}")
             return None
 
     def _generate_product_url(self, product_name: str, ean: str) -> str:
         """Generate product URL from name and EAN"""
-        import re
-        url_name = product_name.strip()
-        url_name = re.sub(r'[^a-zA-Z0-9]+', '-', url_name)
-        url_name = re.sub(r'-+', '-', url_name)
-        url_name = url_name.strip('-')
+        url_name = _SLUG_RE.sub('-', product_name.strip()).strip('-')
         return f"{self.BASE_URL}{url_name}/{ean}"
 
     def validate_ean(self, ean_code: Any) -> Optional[str]:
         """Validate EAN code format"""
-        try:
-            ean_str = str(ean_code).strip()
-            if not ean_str.isdigit():
-                self.logger.warning(f"Invalid EAN (non-digits): {ean_str}")
-                return None
-            if len(ean_str) not in [12, 13, 14]:
-                self.logger.warning(f"Invalid EAN length: {ean_str}")
-                return None
+        ean_str = str(ean_code).strip()
+        if _EAN_RE.fullmatch(ean_str):
             return ean_str
-        except (TypeError, ValueError) as e:
-            self.logger.warning(f"EAN validation failed: {e}")
+
+        # Invalid EANs are common in the feed: count them for the summary
+        # instead of warning on every row
+        self._stage_count('invalid_ean_count')
+        self.logger.debug("Invalid EAN: %s", ean_str)
+        return None
+
+    def _build_retailer_product(self, raw_product: Dict[str, Any]) -> Optional[RetailerProduct]:
+        """
+        Validate a raw record and build its RetailerProduct
+
+        Returns:
+            Optional[RetailerProduct]: Product, or None if the record is skipped
+        """
+        ean, name, brand, category, sales_unit, price_comparison_unit = _RETAILER_FIELDS(raw_product)
+        ean = self.validate_ean(ean)
+        if not ean:
             return None
 
-    def process_record(self, raw_product: Dict[str, Any]) -> None:
-        """Process a single product record"""
-        try:
-            ean = self.validate_ean(raw_product.get('ean'))
-            if not ean:
-                return
+        product = RetailerProduct(
+            ean=ean,
+            name=name,
+            brand=brand,
+            category=category,
+            sales_unit=sales_unit,
+            price_comparison_unit=price_comparison_unit
+        )
 
-            product = RetailerProduct(
-                ean=ean,
-                name=raw_product.get('name', ''),
-                brand=raw_product.get('brand', ''),
-                category=raw_product.get('category', ''),
-                sales_unit=raw_product.get('sales_unit'),
-                price_comparison_unit=raw_product.get('comparison_price_unit')
-            )
+        if not all([product.name, product.category]):
+            self._stage_count('missing_data_count')
+            self.logger.debug("Skipping product with EAN %s: Missing required data", ean)
+            return None
 
-            if not all([product.name, product.category]):
-                self.logger.warning(f"Skipping product with EAN {ean}: Missing required data")
-                return
+        return product
 
-            self._process_retailer_product(product)
+    def process_record(self, raw_product: Dict[str, Any], cursor) -> None:
+        """Process a single product record"""
+        try:
+            product = self._build_retailer_product(raw_product)
+            if product:
+                self._process_retailer_product(cursor, product)
 
         except Exception as e:
             self.logger.error(f"Error processing product with EAN {raw_product.get('ean')}: {e}")
             raise
 
-    def _process_retailer_product(self, product: RetailerProduct) -> None:
+    def process_records_bulk(self, batch: List[Dict[str, Any]], cursor) -> None:
+        """
+        Write a batch of retailer products with a handful of statements
+
+        Product ids are taken from the EAN index loaded by process_all,
+        existing retailer products are updated with one CASE-keyed UPDATE
+        and new ones inserted with one multi-row INSERT. If the bulk write fails, the batch is retried
+        record by record.
+
+        Args:
+            batch: Raw product records
+            cursor: Database cursor of the batch transaction
+        """
+        products: Dict[str, RetailerProduct] = {}
+        for raw_product in batch:
+            product = self._build_retailer_product(raw_product)
+            if product:
+                # A later record for the same EAN wins
+                products[product.ean] = product
+
+        if not products:
+            self._commit_counts(processed=len(batch))
+            return
+
+        # Resolve categories before the bulk write's savepoint, so a rolled
+        # back bulk write can't leave ids of undone inserts in the cache
+        try:
+            self._ensure_categories(cursor, {p.category for p in products.values()})
+        except Exception as e:
+            self.logger.error("Error managing categories: %s", e)
+
+        self._write_bulk_with_fallback(
+            batch, cursor, lambda: self._write_retailer_products(cursor, list(products.values()))
+        )
+
+    def _write_retailer_products(self, cursor, products: List[RetailerProduct]) -> None:
+        """
+        Update existing and insert new retailer products in bulk
+
+        Args:
+            cursor: Database cursor
+            products (List[RetailerProduct]): Products to write, unique by EAN
+        """
+        product_ids = self._ean_index
+
+        category_ids = self._category_cache
+
+        # Rows keyed by product_id, in RETAILER_PRODUCT_COLUMNS order
+        rows: Dict[int, tuple] = {}
+        for product in products:
+            product_id = product_ids.get(product.ean)
+            if not product_id:
+                self._stage_count('missing_product_count')
+                self.logger.debug("No product_id found for EAN: %s", product.ean)
+                continue
+
+            category_id = category_ids.get(product.category)
+            if not category_id:
+                self._stage_count('missing_category_count')
+                self.logger.debug("Failed to process category for EAN: %s", product.ean)
+                continue
+
+            rows[product_id] = (
+                product.name, product.brand, category_id,
+                product.sales_unit, product.price_comparison_unit,
+                self._generate_product_url(product.name, product.ean)
+            )
+
+        if not rows:
+            return
+
+        columns = ', '.join(self.RETAILER_PRODUCT_COLUMNS)
+        cursor.execute(f"""
+            SELECT product_id, {columns}
+            FROM retailers_products 
+            WHERE retailer_id = %s AND product_id IN %s
+        """, (self.RETAILER_ID, tuple(rows)))
+        existing = {
+            row['product_id']: tuple(row[column] for column in self.RETAILER_PRODUCT_COLUMNS)
+            for row in cursor.fetchall()
+        }
+
+        # Existing retailer products are only updated if a column has changed
+        updates = {
+            product_id: row for product_id, row in rows.items()
+            if product_id in existing and existing[product_id] != row
+        }
+        self._stage_count(
+            'unchanged_count', sum(1 for product_id in existing if product_id not in updates)
+        )
+        if updates:
+            self._update_retailer_products(cursor, updates)
+
+        inserts = [
+            (self.RETAILER_ID, product_id) + row
+            for product_id, row in rows.items() if product_id not in existing
+        ]
+        execute_values(cursor, """
+            INSERT INTO retailers_products (
+                retailer_id, product_id, variant_name, brand,
+                category_id, retail_unit, retail_price_comparison_unit,
+                url_product, created, updated
+            ) VALUES {values}
+        """, inserts, "(%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())")
+
+        self._stage_count('updated_count', len(updates))
+        self._stage_count('created_count', len(inserts))
+        self.logger.info("Updated %d and inserted %d retailer products", len(updates), len(inserts))
+
+    def _update_retailer_products(self, cursor, rows: Dict[int, tuple]) -> None:
+        """
+        Update several retailer products with one statement
+
+        Each column is set with a CASE on product_id, so every product gets
+        its own values from a single UPDATE.
+
+        Args:
+            cursor: Database cursor
+            rows: Column values in RETAILER_PRODUCT_COLUMNS order, keyed by product_id
+        """
+        arms = ' '.join(['WHEN %s THEN %s'] * len(rows))
+        assignments = ', '.join(
+            f"{column} = CASE product_id {arms} END" for column in self.RETAILER_PRODUCT_COLUMNS
+        )
+
+        params = []
+        for index in range(len(self.RETAILER_PRODUCT_COLUMNS)):
+            for product_id, row in rows.items():
+                params.extend((product_id, row[index]))
+        params.extend((self.RETAILER_ID, tuple(rows)))
+
+        cursor.execute(f"""
+            UPDATE retailers_products
+            SET {assignments},
+                updated = NOW()
+            WHERE retailer_id = %s AND product_id IN %s
+        """, params)
+
+    def _process_retailer_product(self, cursor, product: RetailerProduct) -> None:
         """Process a single retailer product"""
         try:
-            with self.db_manager.transaction('svenn_products') as cursor:
-                # Get product_id
-                product_id = self._get_product_id_by_ean(cursor, product.ean)
-                if not product_id:
-                    self.logger.warning(f"No product_id found for EAN: {product.ean}")
-                    return
-
-                # Get or create category
-                category_id = self._insert_or_update_category(cursor, product.category)
-                if not category_id:
-                    self.logger.warning(f"Failed to process category for EAN: {product.ean}")
-                    return
-
-                # Generate product URL
-                url_product = self._generate_product_url(product.name, product.ean)
-
-                # Check if retailer product exists
+            # Get product_id
+            product_id = self._get_product_id_by_ean(cursor, product.ean)
+            if not product_id:
+                self._stage_count('missing_product_count')
+                self.logger.debug("No product_id found for EAN: %s", product.ean)
+                return
+
+            # Get or create category
+            category_id = self._get_category_id(cursor, product.category)
+            if not category_id:
+                self._stage_count('missing_category_count')
+                self.logger.debug("Failed to process category for EAN: %s", product.ean)
+                return
+
+            # Generate product URL
+            url_product = self._generate_product_url(product.name, product.ean)
+
+            # Check if retailer product exists
+            cursor.execute("""
+                SELECT product_id 
+                FROM retailers_products 
+                WHERE product_id = %s AND retailer_id = %s
+            """, (product_id, self.RETAILER_ID))
+
+            if cursor.fetchone():
+                # Update existing product
                 cursor.execute("""
-                    SELECT product_id 
-                    FROM retailers_products 
+                    UPDATE retailers_products
+                    SET variant_name = %s, brand = %s, category_id = %s,
+                        retail_unit = %s, retail_price_comparison_unit = %s,
+                        url_product = %s, updated = NOW()
                     WHERE product_id = %s AND retailer_id = %s
-                """, (product_id, self.RETAILER_ID))
-
-                if cursor.fetchone():
-                    # Update existing product
-                    cursor.execute("""
-                        UPDATE retailers_products
-                        SET variant_name = %s, brand = %s, category_id = %s,
-                            retail_unit = %s, retail_price_comparison_unit = %s,
-                            url_product = %s, updated = NOW()
-                        WHERE product_id = %s AND retailer_id = %s
-                    """, (
-                        product.name, product.brand, category_id,
-                        product.sales_unit, product.price_comparison_unit,
-                        url_product, product_id, self.RETAILER_ID
-                    ))
-                    self.updated_count += 1
-                    self.logger.info(f"Updated retailer product: {product.ean}")
-                else:
-                    # Insert new product
-                    cursor.execute("""
-                        INSERT INTO retailers_products (
-                            retailer_id, product_id, variant_name, brand,
-                            category_id, retail_unit, retail_price_comparison_unit,
-                            url_product, created, updated
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                    """, (
-                        self.RETAILER_ID, product_id, product.name, product.brand,
-                        category_id, product.sales_unit, product.price_comparison_unit,
-                        url_product
-                    ))
-                    self.created_count += 1
-                    self.logger.info(f"Inserted new retailer product: {product.ean}")
+                """, (
+                    product.name, product.brand, category_id,
+                    product.sales_unit, product.price_comparison_unit,
+                    url_product, product_id, self.RETAILER_ID
+                ))
+                self._stage_count('updated_count')
+                self.logger.debug("Updated retailer product: %s", product.ean)
+            else:
+                # Insert new product
+                cursor.execute("""
+                    INSERT INTO retailers_products (
+                        retailer_id, product_id, variant_name, brand,
+                        category_id, retail_unit, retail_price_comparison_unit,
+                        url_product, created, updated
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                """, (
+                    self.RETAILER_ID, product_id, product.name, product.brand,
+                    category_id, product.sales_unit, product.price_comparison_unit,
+                    url_product
+                ))
+                self._stage_count('created_count')
+                self.logger.debug("Inserted new retailer product: %s", product.ean)
 
         except Exception as e:
             self.logger.error(f"Error processing retailer product {product.ean}: {e}")
             raise
 
-
-def main():
-    """Main execution function"""
-    import os
-    import flask
-    from pathlib import Path
-    from app.jobs.common.database_manager import DatabaseManager
-
+    def _log_summary(self) -> None:
+        """Override base class log_summary to include retailer product-specific stats"""
+        super()._log_summary()
+        self.logger.info("\nRetailer Product Processing Details:")
+        self.logger.info("New retailer products inserted: %d", self.created_count)
+        self.logger.info("Existing retailer products updated: %d", self.updated_count)
+        self.logger.info("Existing retailer products unchanged: %d", self.unchanged_count)
+        self.logger.info("Records skipped (invalid EAN): %d", self.invalid_ean_count)
+        self.logger.info("Records skipped (missing data): %d", self.missing_data_count)
+        self.logger.info("Records skipped (no product for EAN): %d", self.missing_product_count)
+        self.logger.info("Records skipped (no category): %d", self.missing_category_count)
+
+
+def main(db_manager: Optional[DatabaseManager] = None):
+    """
+    Main execution function
+
+    Args:
+        db_manager: DatabaseManager to run with, passed in by the scheduler;
+            standalone runs create their own from --env
+    """
     logger = setup_script_logging("retailer_byggmakker")
     logger.info("Starting retailer_byggmakker script")
 
-    # Check if running in Flask context
-    if flask.has_app_context():
-        logger.info("Running in Flask context")
-        env_path = Path(os.getcwd()) / '.env'
+    # The scheduler's manager (and its open connections) outlives the run
+    owns_manager = db_manager is None
+    if not owns_manager:
+        logger.info("Running with the scheduler's DatabaseManager")
     else:
+        default_env_path = Path(os.getcwd()) / '.env'
         import argparse
         logger.info("Running in standalone mode")
         parser = argparse.ArgumentParser(description="Process Byggmakker retailer data.")
         parser.add_argument(
             "--env",
             type=str,
-            default=str(Path(os.getcwd()) / '.env'),
+            default=str(default_env_path),
             help="Path to the environment file"
         )
         args = parser.parse_args()
         env_path = Path(args.env)
 
-    db_manager = None
     try:
-        logger.info(f"Using env file at: {env_path.absolute()}")
-        if not env_path.exists():
-            logger.error(f"Environment file not found at: {env_path.absolute()}")
-            raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
-
-        db_manager = DatabaseManager(env_path)
-        logger.info("DatabaseManager initialized successfully")
+        if owns_manager:
+            logger.info(f"Using env file at: {env_path.absolute()}")
+            if not env_path.exists():
+                logger.error(f"Environment file not found at: {env_path.absolute()}")
+                raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
+            db_manager = DatabaseManager(env_path)
+            logger.info("DatabaseManager initialized successfully")
 
         # Initialize and run processor
         logger.info("Initializing RetailerByggmakkerProcessor")
@@ -240,7 +452,7 @@ def main():
         logger.error(f"Script execution failed: {e}", exc_info=True)
         raise
     finally:
-        if db_manager:
+        if db_manager and owns_manager:
             logger.info("Closing database connections")
             db_manager.close_all_connections()
 
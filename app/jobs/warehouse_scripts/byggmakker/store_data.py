@@ -1,12 +1,15 @@
 # app/jobs/warehouse_scripts/byggmakker/store_data.py
 
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional
 from dataclasses import dataclass
+from pathlib import Path
+import os
 from app.jobs.common.base_processor import BaseProcessor
+from app.jobs.common.database_manager import DatabaseManager, execute_values
 from app.jobs.utils.logging_config import setup_script_logging
 
 
-@dataclass
+@dataclass(slots=True)
 class StoreData:
     """Data class for store information"""
     store_id: str
@@ -17,83 +20,178 @@ class StoreDataProcessor(BaseProcessor):
     """Processes store data from raw database to svenn products database"""
 
     RETAILER_ID = 1  # Hardcoded retailer_id for Byggmakker
+    # Write each batch with one multi-row upsert; set to False to process
+    # stores one by one (e.g. to find a store the upsert chokes on)
+    BULK_UPSERT = True
 
-    def __init__(self, db_manager):
+    # Multi-row upsert of the bulk path, with a {values} placeholder
+    UPSERT_STORES_SQL = """
+        INSERT INTO stores (store_id, retailer_id, store_name)
+        VALUES {values}
+        ON DUPLICATE KEY UPDATE store_name = VALUES(store_name)
+    """
+    UPSERT_STORES_TEMPLATE = "(%s, %s, %s)"
+    # Statements of the row-by-row path
+    SELECT_STORE_SQL = "SELECT store_name FROM stores WHERE store_id = %s LIMIT 1"
+    UPDATE_STORE_SQL = "UPDATE stores SET store_name = %s WHERE store_id = %s"
+    INSERT_STORE_SQL = "INSERT INTO stores (store_id, retailer_id, store_name) VALUES (%s, %s, %s)"
+
+    def __init__(self, db_manager, batch_size: int = 5000):
         """
         Initialize the processor with a database manager
 
+        Stores are few and small, so by default a whole chain's stores are
+        written in one transaction (and fetched as one page)
+
         Args:
             db_manager: DatabaseManager instance
+            batch_size: Number of stores per transaction
         """
-        super().__init__(db_manager)
+        super().__init__(db_manager, batch_size)
         self.inserted_count = 0
         self.updated_count = 0
         self.skipped_count = 0
+        self._existing_stores: Dict[str, str] = {}
+
+    def process_all(self) -> None:
+        """Load the retailer's existing stores, then process all store records"""
+        self._existing_stores = self._load_existing_stores()
+        super().process_all()
+
+    def _load_existing_stores(self) -> Dict[str, str]:
+        """Map the store_id of each of the retailer's stores to its name"""
+        rows = self.db_manager.execute_query(
+            'svenn_products',
+            "SELECT store_id, store_name FROM stores WHERE retailer_id = %s",
+            (self.RETAILER_ID,)
+        )
+        return {str(row['store_id']): row['store_name'] for row in rows}
 
-    def _fetch_raw_data(self) -> List[Dict[str, Any]]:
-        """Fetch store data from raw_data database"""
+    def _fetch_raw_data(self) -> Iterator[Dict[str, Any]]:
+        """
+        Fetch store data from raw_data database
+
+        store_id isn't known to be unique in byggmakker_store_ids, so the
+        table is streamed rather than keyset-paged on it: paging on a
+        non-unique key skips duplicates that straddle a page boundary
+        """
         query = """
             SELECT store_id, store_name 
             FROM byggmakker_store_ids 
             ORDER BY store_id
         """
-        return self.db_manager.execute_query('raw_data', query)
+        return self.db_manager.stream_query('raw_data', query)
 
-    def process_record(self, raw_store: Dict[str, Any]) -> None:
-        """Process a single store record"""
-        try:
-            store = StoreData(
-                store_id=raw_store['store_id'],
-                store_name=raw_store['store_name']
-            )
+    def _build_store(self, raw_store: Dict[str, Any]) -> Optional[StoreData]:
+        """
+        Validate a raw record and build its StoreData
 
-            if not all([store.store_id, store.store_name]):
-                self.logger.warning(f"Skipping store: Missing required data")
-                return
+        Returns:
+            Optional[StoreData]: Store data, or None if the record is skipped
+        """
+        store_id, store_name = raw_store['store_id'], raw_store['store_name']
+        if not store_id or not store_name:
+            self.logger.warning(f"Skipping store: Missing required data")
+            return None
 
-            self._process_store(store)
+        return StoreData(store_id=store_id, store_name=store_name)
+
+    def process_record(self, raw_store: Dict[str, Any], cursor) -> None:
+        """Process a single store record"""
+        try:
+            store = self._build_store(raw_store)
+            if store:
+                self._process_store(cursor, store)
 
         except Exception as e:
             self.logger.error(f"Error processing store {raw_store.get('store_id')}: {e}")
             raise
 
-    def _process_store(self, store: StoreData) -> None:
+    def process_records_bulk(self, batch: List[Dict[str, Any]], cursor) -> None:
+        """
+        Write a batch of stores with a single multi-row upsert
+
+        Stores are compared with the existing stores loaded by process_all
+        to tell new, renamed and unchanged stores apart; new and renamed
+        stores are then written with one INSERT ... ON DUPLICATE KEY UPDATE.
+        If that fails, the batch is retried store by store.
+
+        Args:
+            batch: Raw store records
+            cursor: Database cursor of the batch transaction
+        """
+        if not self.BULK_UPSERT:
+            super().process_records_bulk(batch, cursor)
+            return
+
+        stores: Dict[str, StoreData] = {}
+        for raw_store in batch:
+            store = self._build_store(raw_store)
+            if store:
+                stores[store.store_id] = store
+
+        if not stores:
+            self._commit_counts(processed=len(batch))
+            return
+
+        self._write_bulk_with_fallback(
+            batch, cursor, lambda: self._upsert_stores(cursor, list(stores.values()))
+        )
+
+    def _upsert_stores(self, cursor, stores: List[StoreData]) -> None:
+        """
+        Insert new and rename existing stores in bulk
+
+        Args:
+            cursor: Database cursor
+            stores (List[StoreData]): Stores to write, unique by store_id
+        """
+        existing = self._existing_stores
+
+        inserts, updates = [], []
+        for store in stores:
+            existing_name = existing.get(str(store.store_id))
+            if existing_name is None:
+                inserts.append((store.store_id, self.RETAILER_ID, store.store_name))
+            elif existing_name != store.store_name:
+                updates.append((store.store_id, self.RETAILER_ID, store.store_name))
+
+        rows = inserts + updates
+        execute_values(cursor, self.UPSERT_STORES_SQL, rows, self.UPSERT_STORES_TEMPLATE)
+
+        existing.update((str(store_id), store_name) for store_id, _, store_name in rows)
+        # The counters follow from the partition; nothing is counted per row
+        self._stage_count('inserted_count', len(inserts))
+        self._stage_count('updated_count', len(updates))
+        self._stage_count('skipped_count', len(stores) - len(rows))
+
+    def _process_store(self, cursor, store: StoreData) -> None:
         """
         Process a single store
 
         Args:
+            cursor: Database cursor
             store: Store data to process
         """
         try:
-            with self.db_manager.transaction('svenn_products') as cursor:
-                # Check if store exists
-                cursor.execute(
-                    "SELECT store_id, store_name FROM stores WHERE store_id = %s",
-                    (store.store_id,)
-                )
-                existing_store = cursor.fetchone()
-
-                if existing_store:
-                    # Update if store name has changed
-                    if existing_store['store_name'] != store.store_name:
-                        cursor.execute("""
-                            UPDATE stores 
-                            SET store_name = %s 
-                            WHERE store_id = %s
-                        """, (store.store_name, store.store_id))
-                        self.updated_count += 1
-                        self.logger.info(f"Updated store: {store.store_name} (ID: {store.store_id})")
-                    else:
-                        self.skipped_count += 1
-                        self.logger.debug(f"Skipped existing store: {store.store_name} (ID: {store.store_id})")
+            # Check if store exists (only its name is needed)
+            cursor.execute(self.SELECT_STORE_SQL, (store.store_id,))
+            existing_store = cursor.fetchone()
+
+            if existing_store:
+                # Update if store name has changed
+                if existing_store['store_name'] != store.store_name:
+                    cursor.execute(self.UPDATE_STORE_SQL, (store.store_name, store.store_id))
+                    self._stage_count('updated_count')
+                    self.logger.debug("Updated store: %s (ID: %s)", store.store_name, store.store_id)
                 else:
-                    # Insert new store
-                    cursor.execute("""
-                        INSERT INTO stores (store_id, retailer_id, store_name)
-                        VALUES (%s, %s, %s)
-                    """, (store.store_id, self.RETAILER_ID, store.store_name))
-                    self.inserted_count += 1
-                    self.logger.info(f"Inserted new store: {store.store_name} (ID: {store.store_id})")
+                    self._stage_count('skipped_count')
+                    self.logger.debug("Skipped existing store: %s (ID: %s)", store.store_name, store.store_id)
+            else:
+                # Insert new store
+                cursor.execute(self.INSERT_STORE_SQL, (store.store_id, self.RETAILER_ID, store.store_name))
+                self._stage_count('inserted_count')
+                self.logger.debug("Inserted new store: %s (ID: %s)", store.store_name, store.store_id)
 
         except Exception as e:
             self.logger.error(f"Error processing store {store.store_id}: {e}")
@@ -103,47 +201,48 @@ class StoreDataProcessor(BaseProcessor):
         """Override base class log_summary to include store-specific stats"""
         super()._log_summary()
         self.logger.info("\nStore Processing Details:")
-        self.logger.info(f"New stores inserted: {self.inserted_count}")
-        self.logger.info(f"Existing stores updated: {self.updated_count}")
-        self.logger.info(f"Stores skipped (no changes): {self.skipped_count}")
+        self.logger.info("New stores inserted: %d", self.inserted_count)
+        self.logger.info("Existing stores updated: %d", self.updated_count)
+        self.logger.info("Stores skipped (no changes): %d", self.skipped_count)
 
 
-def main():
-    """Main execution function"""
-    import os
-    import flask
-    from pathlib import Path
-    from app.jobs.common.database_manager import DatabaseManager
+def main(db_manager: Optional[DatabaseManager] = None):
+    """
+    Main execution function
 
+    Args:
+        db_manager: DatabaseManager to run with, passed in by the scheduler;
+            standalone runs create their own from --env
+    """
     logger = setup_script_logging("store_byggmakker")
     logger.info("Starting store_byggmakker script")
 
-    # Check if running in Flask context
-    if flask.has_app_context():
-        logger.info("Running in Flask context")
-        env_path = Path(os.getcwd()) / '.env'
+    # The scheduler's manager (and its open connections) outlives the run
+    owns_manager = db_manager is None
+    if not owns_manager:
+        logger.info("Running with the scheduler's DatabaseManager")
     else:
+        default_env_path = Path(os.getcwd()) / '.env'
         import argparse
         logger.info("Running in standalone mode")
         parser = argparse.ArgumentParser(description="Process Byggmakker store data.")
         parser.add_argument(
             "--env",
             type=str,
-            default=str(Path(os.getcwd()) / '.env'),
+            default=str(default_env_path),
             help="Path to the environment file"
         )
         args = parser.parse_args()
         env_path = Path(args.env)
 
-    db_manager = None
     try:
-        logger.info(f"Using env file at: {env_path.absolute()}")
-        if not env_path.exists():
-            logger.error(f"Environment file not found at: {env_path.absolute()}")
-            raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
-
-        db_manager = DatabaseManager(env_path)
-        logger.info("DatabaseManager initialized successfully")
+        if owns_manager:
+            logger.info(f"Using env file at: {env_path.absolute()}")
+            if not env_path.exists():
+                logger.error(f"Environment file not found at: {env_path.absolute()}")
+                raise FileNotFoundError(f"Environment file not found at: {env_path.absolute()}")
+            db_manager = DatabaseManager(env_path)
+            logger.info("DatabaseManager initialized successfully")
 
         # Initialize and run processor
         logger.info("Initializing StoreDataProcessor")
@@ -155,7 +254,7 @@ def main():
         logger.error(f"Script execution failed: {e}", exc_info=True)
         raise
     finally:
-        if db_manager:
+        if db_manager and owns_manager:
             logger.info("Closing database connections")
             db_manager.close_all_connections()
 
@@ -12,18 +12,21 @@ class Script(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
     filename = db.Column(db.String(128), nullable=False)
-    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False, index=True)
     description = db.Column(db.String(256))
-    jobs = db.relationship('Job', backref='script', lazy=True)
+    # Never lazy-load the jobs collection; query it explicitly when needed.
+    # passive_deletes keeps the unit of work from loading it on delete.
+    jobs = db.relationship('Job', backref='script', lazy='raise', passive_deletes=True)
 
 class Job(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     job_id = db.Column(db.String(36), unique=True, nullable=False)  # APScheduler job ID
-    script_id = db.Column(db.Integer, db.ForeignKey('script.id'), nullable=False)
+    script_id = db.Column(db.Integer, db.ForeignKey('script.id'), nullable=False, index=True)
     cron_expression = db.Column(db.String(128))
     enabled = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    executions = db.relationship('JobExecution', backref='job', lazy=True)
+    # Load explicitly (e.g. selectinload) where the executions are needed
+    executions = db.relationship('JobExecution', backref='job', lazy='raise')
 
 class JobExecution(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -31,4 +34,7 @@ class JobExecution(db.Model):
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime)
     status = db.Column(db.String(20))  # 'running', 'completed', 'failed'
-    error_message = db.Column(db.Text)
\ No newline at end of file
+    error_message = db.Column(db.Text)
+
+# Backs the per-job execution history, which is listed newest first
+db.Index('ix_jobexecution_job_start', JobExecution.job_id, JobExecution.start_time.desc())
\ No newline at end of file
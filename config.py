@@ -11,6 +11,25 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connections are pinged on checkout, as pool_recycle alone doesn't
+    # catch connections dropped by a server restart, failover or network
+    # timeout. LIFO reuses the most recently returned (warm) connection and
+    # lets the rest idle
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'pool_use_lifo': True
+    }
+
+    # Response cache (disabled when REDIS_URL is not set)
+    REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+
+    # Scheduler configuration
+    SCHEDULER_MAX_WORKERS = int(os.environ.get('SCHEDULER_MAX_WORKERS', 30))
+    SCHEDULER_MISFIRE_GRACE_TIME = 300
 
     # Jobs folder path
     JOBS_FOLDER = os.path.join(basedir, 'app', 'jobs')
\ No newline at end of file
@@ -5,6 +5,8 @@ Revises: 8d79800cd999
 Create Date: 2025-01-03 09:08:13.037957
 
 """
+from types import MappingProxyType
+
 from alembic import op
 import sqlalchemy as sa
 from sqlalchemy.sql import table, column
@@ -24,61 +26,33 @@ scripts_table = table('script',
                       column('warehouse_id', sa.Integer)
                       )
 
+# Old filenames mapped to the new warehouse-based structure, and back
+FILENAME_MAP = MappingProxyType({
+    'base_byggmakker.py': 'byggmakker/base_data.py',
+    'store_byggmakker.py': 'byggmakker/store_data.py',
+    'store_prices.py': 'byggmakker/prices.py',
+    'retailer_byggmakker.py': 'byggmakker/retailer_data.py'
+})
+REVERSE_MAP = MappingProxyType({new: old for old, new in FILENAME_MAP.items()})
 
-def map_filename(old_filename):
-    """Map old filename to new warehouse-based structure"""
-    filename_mapping = {
-        'base_byggmakker.py': 'byggmakker/base_data.py',
-        'store_byggmakker.py': 'byggmakker/store_data.py',
-        'store_prices.py': 'byggmakker/prices.py',
-        'retailer_byggmakker.py': 'byggmakker/retailer_data.py'
-    }
-    return filename_mapping.get(old_filename, old_filename)
 
+def rename_scripts(connection, filename_mapping):
+    """
+    Rename scripts according to filename_mapping (old -> new filename)
 
-def upgrade():
-    # Create a connection
-    connection = op.get_bind()
+    A single UPDATE with a CASE on the current filename renames every
+    matching script in one round trip.
+    """
+    connection.execute(
+        scripts_table.update()
+        .where(scripts_table.c.filename.in_(list(filename_mapping)))
+        .values(filename=sa.case(dict(filename_mapping), value=scripts_table.c.filename))
+    )
 
-    # Get all existing scripts
-    scripts = connection.execute(
-        scripts_table.select()
-    ).fetchall()
 
-    # Update each script's filename
-    for script in scripts:
-        new_filename = map_filename(script.filename)
-        if new_filename != script.filename:
-            connection.execute(
-                scripts_table.update()
-                .where(scripts_table.c.id == script.id)
-                .values(filename=new_filename)
-            )
+def upgrade():
+    rename_scripts(op.get_bind(), FILENAME_MAP)
 
 
 def downgrade():
-    # Create a connection
-    connection = op.get_bind()
-
-    # Reverse filename mapping
-    reverse_mapping = {
-        'byggmakker/base_data.py': 'base_byggmakker.py',
-        'byggmakker/store_data.py': 'store_byggmakker.py',
-        'byggmakker/prices.py': 'store_prices.py',
-        'byggmakker/retailer_data.py': 'retailer_byggmakker.py'
-    }
-
-    # Get all scripts
-    scripts = connection.execute(
-        scripts_table.select()
-    ).fetchall()
-
-    # Revert each script's filename
-    for script in scripts:
-        old_filename = reverse_mapping.get(script.filename, script.filename)
-        if old_filename != script.filename:
-            connection.execute(
-                scripts_table.update()
-                .where(scripts_table.c.id == script.id)
-                .values(filename=old_filename)
-            )
\ No newline at end of file
+    rename_scripts(op.get_bind(), REVERSE_MAP)
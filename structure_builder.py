@@ -1,28 +1,38 @@
 import os
 
 def print_directory_structure(start_path, indent_level=0, file=None, exclude_root=False):
-    """Recursively prints the directory structure from the start_path and writes to a file."""
+    """Prints the directory structure (depth first) from the start_path and writes it to a file."""
     excluded_files = {"project_structure.txt", "structure_builder.py"}
     excluded_folders = {".venv", ".idea", "__pycache__", "build"}
 
-    try:
-        entries = os.listdir(start_path)
-        for entry in entries:
-            entry_path = os.path.join(start_path, entry)
-            if entry in excluded_folders or entry in excluded_files:
-                continue
-            line = '    ' * indent_level + f"|- {entry}\n"
-            print(line, end='')
-            if file:
-                file.write(line)
-
-            if os.path.isdir(entry_path):
-                print_directory_structure(entry_path, indent_level + 1, file)
-    except PermissionError:
-        line = '    ' * indent_level + "|- [Permission Denied]\n"
-        print(line, end='')
-        if file:
-            file.write(line)
+    def list_entries(path, level):
+        # Entries reversed, so popping them off the stack keeps their order;
+        # None marks a directory that couldn't be read
+        try:
+            with os.scandir(path) as it:
+                entries = [entry for entry in it
+                           if entry.name not in excluded_folders and entry.name not in excluded_files]
+        except PermissionError:
+            return [(None, level)]
+        return [(entry, level) for entry in reversed(entries)]
+
+    lines = []
+    stack = list_entries(start_path, indent_level)
+    while stack:
+        entry, level = stack.pop()
+        if entry is None:
+            lines.append('    ' * level + "|- [Permission Denied]\n")
+            continue
+
+        lines.append('    ' * level + f"|- {entry.name}\n")
+        # DirEntry caches the type from the directory listing, so this
+        # usually needs no extra stat call
+        if entry.is_dir():
+            stack.extend(list_entries(entry.path, level + 1))
+
+    print(''.join(lines), end='')
+    if file:
+        file.writelines(lines)
 
 if __name__ == "__main__":
     # Define the root directory of your web project.